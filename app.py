@@ -1,18 +1,40 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, Response, stream_with_context, g
+from werkzeug.http import is_resource_modified
 import pandas as pd
 import pymysql
 import os
 import time
-from datetime import datetime
-import shutil
+import hashlib
+from datetime import datetime, timezone
 import json
 import uuid
-import zipfile
-from csv2coco import csv2coco
+import itertools
+import threading
+from csv2coco import df2coco
+from coco_writer import CocoWriter, is_compact, iter_coco_json, iter_selected_records
+from concurrent.futures import ProcessPoolExecutor
+from jobs import JobManager
+from db_pool import ConnectionPool
+from zip_stream import iter_zip
+from task_store import TaskIndex, TaskStore
+from coco_query import FILTER_KEYS, normalize_status, parse_filters
+from staging import ImageStager, COPIED, LINKED, SKIPPED, FAILED
+from blob_store import BlobStore
+from path_probe import PathProbe
+from janitor import ExportJanitor
+from state_store import JobStateStore
+from metrics import REGISTRY, Stopwatch, server_timing
+from thumbnails import ThumbnailCache, FORMATS as THUMBNAIL_FORMATS
+from result_cache import ResultCache, make_cache_key
+from sharding import iter_sharded_frames, render_shard_sqls
+from fanout import SOURCE_COLUMN, iter_fanout_frames, normalize_targets, source_filename
+from sampling import SAMPLE_MODES, reservoir_sample, reservoir_sample_by, sample_sql
+from task_table import TaskTableWriter, read_task_table, has_table, arrow_parts, iter_task_csv
+from incremental import high_water_mark, tail_sql, save_query_info, load_query_info
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'exports'
-CONFIG_FILE = 'config.json'
+app.config['UPLOAD_FOLDER'] = os.getenv('EXPORT_DIR', 'exports')
+CONFIG_FILE = os.getenv('CONFIG_FILE', 'config.json')
 
 # 确保导出目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -35,13 +57,81 @@ DEFAULT_CONFIG = {
         '7': '拼接间隙', '8': '水渍', '9': '烫伤', '10': '破损', 
         '11': '碰伤', '12': '红标签', '13': '线头', '14': '脏污', 
         '15': '褶皱(T型)', '16': '褶皱（重度）', '17': '重跳针'
-    }
+    },
+    'query_chunk_size': 5000,  # 流式查询每批读取的行数
+    'query_workers': 4,  # 后台查询任务并发数（各自从连接池取连接）
+    'job_items_window': 10000,  # 查询执行期间每个任务在内存中保留的部分结果条数，完成后从任务索引分页读取
+    'db_pool_min': 1,  # 连接池最少保持的连接数
+    'db_pool_max': 8,  # 连接池最大连接数
+    'db_pool_timeout': 30,  # 等待可用连接的超时时间（秒）
+    'db_pool_idle_timeout': 300,  # 空闲连接的回收时间（秒）
+    'stage_workers': 8,  # 并行暂存图片的线程数
+    'image_link_mode': 'auto',  # 'auto'（硬链接/reflink/复制）、'reflink' 或 'copy'
+    'image_cache_max_age': 7 * 24 * 3600,  # 浏览器缓存原图的时间（秒），0 表示每次都向服务器确认
+    'path_probe_ttl': 60,  # 图片目录列举结果的缓存时间（秒），期间新出现的图片可能被当作不存在
+    'path_probe_workers': 16,  # 并行列举图片目录的线程数
+    'image_blob_store': True,  # 无法直接硬链接的图片存入 exports/_blobs 供各任务共享，任务目录中只保存硬链接
+    'export_mode': 'copy',  # 'copy' 查询时暂存图片；'lazy' 只记录清单，导出时从原始路径读取
+    'task_cache_bytes': 512 * 1024 * 1024,  # 内存中任务索引的总大小上限（估算值）
+    'coco_parse_workers': 0,  # 大于 1 时使用进程池并行解析 infer_raw_result
+    'thumbnail_size': 320,  # 结果网格缩略图的最大边长（像素）
+    'thumbnail_format': 'jpeg',  # 'jpeg' 或 'webp'
+    'thumbnail_cache_dir': 'cache/thumbnails',  # 缩略图磁盘缓存目录
+    'thumbnail_cache_bytes': 1024 * 1024 * 1024,  # 缩略图缓存总大小上限，超出后按 LRU 删除
+    'thumbnail_workers': 4,  # 生成缩略图的线程数
+    'result_cache_ttl': 3600,  # 相同查询复用已有结果的有效期（秒），0 表示不使用缓存
+    'result_cache_bytes': 10 * 1024 * 1024 * 1024,  # 缓存结果对应任务目录的总大小上限，超出后按 LRU 淘汰
+    # 按 START_TIME/END_TIME 把查询拆分成的时间分片数，1 表示不分片；每个分片包装为子查询执行，
+    # 最外层有 LIMIT 或选择列中有重名的列（如连接查询的 a.*, b.*）时不分片
+    'query_shards': 1,
+    'query_shard_workers': 4,  # 同时执行的分片数（不超过连接池最大连接数）
+    'query_shard_retries': 2,  # 单个分片失败后的重试次数
+    'query_shard_time_field': 'c_time',  # 分片查询的时间字段（查询结果中必须有该列），用于分片边界和合并排序
+    'sample_mode': 'reservoir',  # 'reservoir' 流式蓄水池抽样；'sql' 在数据库端 ORDER BY RAND(seed) LIMIT n
+    'sample_seed': 42,  # 随机采样的固定种子，相同查询得到相同样本
+    'task_storage': 'auto',  # 查询结果的保存格式：'auto'（安装 pyarrow 时使用 Arrow IPC）、'arrow' 或 'csv'
+    'export_max_bytes': 0,  # exports/ 中任务占用空间的上限（字节），超出后按最后访问时间删除任务，0 表示不限制
+    'export_max_age': 30 * 24 * 3600,  # 任务超过该时间（秒）未被访问时删除，0 表示不限制
+    'janitor_interval': 600,  # 后台清理 exports/ 的间隔（秒），0 表示不清理
+    'tail_time_field': 'c_time',  # 增量追加时判断新数据的时间字段
+    'tail_key_field': 'id',  # 增量追加时区分同一时间多行数据的主键字段
+    # 多条产线的数据库：[{"name": "changanlier", "host": ..., "database": ..., "img_base_path": ..., "pool_max": 4}]，
+    # 未填写的连接参数使用上面的默认数据库配置；查询时指定 targets 即可同时查询多个数据库并合并结果
+    'db_targets': []
 }
 
+# 以下配置在进程启动时用于创建线程池、缓存和后台清理，保存后需要重启服务（所有 worker）才能生效；
+# 其他配置（数据库连接、图片路径、查询参数等）在每次请求时读取，保存后立即生效
+RESTART_CONFIG_KEYS = (
+    'query_workers', 'job_items_window', 'stage_workers', 'image_link_mode', 'image_blob_store', 'path_probe_ttl', 'path_probe_workers',
+    'thumbnail_cache_dir', 'thumbnail_cache_bytes', 'thumbnail_workers', 'task_cache_bytes', 'coco_parse_workers',
+    'result_cache_ttl', 'result_cache_bytes', 'export_max_bytes', 'export_max_age', 'janitor_interval'
+)
+
+# 已加载的配置及其文件版本（修改时间 + 大小），版本不变时不重复读取
+_config_cache = {'version': None, 'config': DEFAULT_CONFIG}
+_config_lock = threading.Lock()
+
+
+def config_version():
+    """配置文件的版本，其他 worker 进程保存配置后版本随之变化；文件不存在时返回 None"""
+    try:
+        st = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
 # 配置管理函数
 def load_config():
-    """加载配置文件"""
-    if os.path.exists(CONFIG_FILE):
+    """加载配置文件（配置文件版本未变化时直接返回已加载的配置）"""
+    version = config_version()
+    with _config_lock:
+        if version == _config_cache['version']:
+            return _config_cache['config']
+    if version is None:
+        config = DEFAULT_CONFIG
+    else:
         try:
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
                 config = json.load(f)
@@ -51,17 +141,34 @@ def load_config():
                 # 确保 id2name 存在且是字典格式
                 if 'id2name' not in merged_config or not isinstance(merged_config.get('id2name'), dict):
                     merged_config['id2name'] = DEFAULT_CONFIG['id2name']
-                return merged_config
+                config = merged_config
         except Exception as e:
             print(f"⚠️ 加载配置文件失败: {e}，使用默认配置")
             return DEFAULT_CONFIG
-    return DEFAULT_CONFIG
+    with _config_lock:
+        _config_cache['version'] = version
+        _config_cache['config'] = config
+    return config
+
+def read_saved_config():
+    """读取配置文件中保存的配置（不合并默认配置），文件不存在或无法解析时返回空字典"""
+    if not os.path.exists(CONFIG_FILE):
+        return {}
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return config if isinstance(config, dict) else {}
+    except Exception as e:
+        print(f"⚠️ 读取配置文件失败: {e}")
+        return {}
 
 def save_config(config):
-    """保存配置文件"""
+    """保存配置文件（先写临时文件再替换，其他进程不会读到写了一半的文件）"""
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+        tmp_path = f'{CONFIG_FILE}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, CONFIG_FILE)
         return True
     except Exception as e:
         print(f"❌ 保存配置文件失败: {e}")
@@ -83,99 +190,229 @@ IMG_BASE_PATH = os.getenv('IMG_BASE_PATH', APP_CONFIG.get('img_base_path', DEFAU
 
 
 class MySQLClient:
-    def __init__(self, host, user, password, database):
+    """MySQL 客户端，每次查询从连接池取出独立连接，可在多个线程中并发使用"""
+
+    def __init__(self, host, user, password, database, pool_min=1, pool_max=5,
+                 pool_timeout=30, pool_idle_timeout=300):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
-        self.connection = None
+        self.pool_options = {
+            'min_size': pool_min,
+            'max_size': pool_max,
+            'checkout_timeout': pool_timeout,
+            'idle_timeout': pool_idle_timeout
+        }
+        self.pool = None
         self.connect()
 
+    def _new_connection(self):
+        return pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            charset='utf8mb4'
+        )
+
     def connect(self):
         try:
-            self.connection = pymysql.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database,
-                charset='utf8mb4'
-            )
+            self.pool = ConnectionPool(self._new_connection, **self.pool_options)
             print(f"✅ 成功连接到MySQL数据库: {self.database}")
         except Exception as e:
             print(f"❌ 连接数据库失败: {e}")
-            self.connection = None
+            self.pool = None
 
-    def query(self, sql):
-        if self.connection is None:
+    def _ensure_pool(self):
+        if self.pool is None:
             print("⚠️ 数据库未连接，正在尝试重新连接...")
             self.connect()
-            if self.connection is None:
-                print("❌ 重新连接数据库失败")
-                return None
+        return self.pool is not None
+
+    def query(self, sql):
+        if not self._ensure_pool():
+            print("❌ 重新连接数据库失败")
+            return None
         try:
-            df = pd.read_sql(sql, self.connection)
-            return df
+            with self.pool.connection() as conn:
+                return pd.read_sql(sql, conn)
         except Exception as e:
             print(f"❌ 查询失败: {e}")
             return None
 
+    def query_chunks(self, sql, chunk_size=5000):
+        """使用服务端游标（SSCursor）流式查询，每次返回 chunk_size 行的 DataFrame
+
+        结果集不会在客户端整体缓冲，峰值内存只与 chunk_size 有关。
+        各批次的索引连续递增，与一次性查询得到的 DataFrame 索引一致。
+        读取期间独占一个连接，读完后归还；出错或生成器提前关闭时直接关闭该连接，
+        不读完剩余结果（SSCursor.close() 会把剩余的行全部从服务器读出）。
+        """
+        if not self._ensure_pool():
+            raise RuntimeError("重新连接数据库失败")
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            cursor.execute(sql)
+            columns = [desc[0] for desc in cursor.description]
+            offset = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+                df.index = pd.RangeIndex(offset, offset + len(df))
+                offset += len(df)
+                yield df
+            cursor.close()
+
+    def stats(self):
+        return self.pool.stats() if self.pool else None
+
     def close(self):
-        if self.connection:
-            self.connection.close()
-            self.connection = None
+        if self.pool:
+            self.pool.close()
+            self.pool = None
             print("🔌 数据库连接已关闭")
 
 
-# 全局数据库客户端
+# 全局数据库客户端（内部为连接池），替换时持有锁
 db_client = None
+db_client_config = None  # 创建 db_client 时使用的数据库配置，外部注入的客户端为 None
+db_client_lock = threading.Lock()
+
+# 后台查询任务（状态同步到 exports/_state.sqlite，多个 worker 进程共享）
+job_manager = JobManager(
+    max_workers=int(APP_CONFIG.get('query_workers', DEFAULT_CONFIG['query_workers'])),
+    store=JobStateStore(os.path.join(app.config['UPLOAD_FOLDER'], '_state.sqlite')),
+    max_items=int(APP_CONFIG.get('job_items_window', DEFAULT_CONFIG['job_items_window']))
+)
+
+# 跨任务共享的图片仓库（与任务目录同一文件系统，引用计数为硬链接数）
+blob_store = BlobStore(os.path.join(app.config['UPLOAD_FOLDER'], '_blobs')) \
+    if APP_CONFIG.get('image_blob_store', DEFAULT_CONFIG['image_blob_store']) else None
+
+# 图片暂存线程池
+image_stager = ImageStager(
+    max_workers=int(APP_CONFIG.get('stage_workers', DEFAULT_CONFIG['stage_workers'])),
+    link_mode=APP_CONFIG.get('image_link_mode', DEFAULT_CONFIG['image_link_mode']),
+    blob_store=blob_store
+)
+
+# 图片路径检查（按目录批量列举并缓存，图片目录是网络共享时避免逐个 stat）
+path_probe = PathProbe(
+    ttl=float(APP_CONFIG.get('path_probe_ttl', DEFAULT_CONFIG['path_probe_ttl'])),
+    max_workers=int(APP_CONFIG.get('path_probe_workers', DEFAULT_CONFIG['path_probe_workers']))
+)
+
+# 缩略图缓存（结果网格使用，弹窗仍显示原图）
+thumbnail_cache = ThumbnailCache(
+    APP_CONFIG.get('thumbnail_cache_dir', DEFAULT_CONFIG['thumbnail_cache_dir']),
+    max_bytes=int(APP_CONFIG.get('thumbnail_cache_bytes', DEFAULT_CONFIG['thumbnail_cache_bytes'])),
+    max_workers=int(APP_CONFIG.get('thumbnail_workers', DEFAULT_CONFIG['thumbnail_workers']))
+)
+
+
+def db_config_from(app_config):
+    return {
+        'host': app_config.get('db_host', DEFAULT_CONFIG['db_host']),
+        'user': app_config.get('db_user', DEFAULT_CONFIG['db_user']),
+        'password': app_config.get('db_password', DEFAULT_CONFIG['db_password']),
+        'database': app_config.get('db_database', DEFAULT_CONFIG['db_database'])
+    }
+
+
+def create_db_client(db_config, app_config):
+    """按配置创建带连接池的数据库客户端"""
+    return MySQLClient(
+        host=db_config['host'],
+        user=db_config['user'],
+        password=db_config['password'],
+        database=db_config['database'],
+        pool_min=int(app_config.get('db_pool_min', DEFAULT_CONFIG['db_pool_min'])),
+        pool_max=int(app_config.get('db_pool_max', DEFAULT_CONFIG['db_pool_max'])),
+        pool_timeout=float(app_config.get('db_pool_timeout', DEFAULT_CONFIG['db_pool_timeout'])),
+        pool_idle_timeout=float(app_config.get('db_pool_idle_timeout', DEFAULT_CONFIG['db_pool_idle_timeout']))
+    )
 
 
 def get_db_client():
-    global db_client, DB_CONFIG, APP_CONFIG
-    # 重新加载配置以确保使用最新配置
+    """返回数据库客户端；数据库配置被修改（包括其他 worker 进程保存的配置）时重建连接池"""
+    global db_client, db_client_config, DB_CONFIG, APP_CONFIG
+    # 配置文件版本变化时才重新读取
     APP_CONFIG = load_config()
-    DB_CONFIG = {
-        'host': APP_CONFIG.get('db_host', DEFAULT_CONFIG['db_host']),
-        'user': APP_CONFIG.get('db_user', DEFAULT_CONFIG['db_user']),
-        'password': APP_CONFIG.get('db_password', DEFAULT_CONFIG['db_password']),
-        'database': APP_CONFIG.get('db_database', DEFAULT_CONFIG['db_database'])
-    }
+    DB_CONFIG = db_config_from(APP_CONFIG)
     
-    if db_client is None:
-        db_client = MySQLClient(
-            host=DB_CONFIG['host'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            database=DB_CONFIG['database']
-        )
-    return db_client
+    old_client = None
+    with db_client_lock:
+        if db_client is None:
+            db_client = create_db_client(DB_CONFIG, APP_CONFIG)
+            db_client_config = DB_CONFIG
+        elif db_client_config is not None and db_client_config != DB_CONFIG:
+            # 正在执行的查询继续使用旧连接，归还时关闭
+            old_client = db_client
+            db_client = create_db_client(DB_CONFIG, APP_CONFIG)
+            db_client_config = DB_CONFIG
+        client = db_client
+    if old_client:
+        try:
+            old_client.close()
+        except Exception:
+            pass
+    return client
+
+
+# 多数据库查询的各目标客户端：名称 → (数据库配置, 客户端)，外部注入的客户端配置为 None
+target_clients = {}
+
+
+def get_target_client(name, target, app_config):
+    """返回数据库目标的客户端（每个目标独立的连接池），目标配置变化时重建"""
+    db_config = dict(db_config_from(app_config), **{field: target[field] for field in ('host', 'user', 'password', 'database')
+                                                    if field in target})
+    pool_config = dict(app_config, db_pool_max=target.get('pool_max', app_config.get('db_pool_max', DEFAULT_CONFIG['db_pool_max'])))
+    fingerprint = dict(db_config, pool_max=pool_config['db_pool_max'])
+    old_client = None
+    with db_client_lock:
+        entry = target_clients.get(name)
+        if entry is None or (entry[0] is not None and entry[0] != fingerprint):
+            old_client = entry[1] if entry else None
+            entry = target_clients[name] = (fingerprint, create_db_client(db_config, pool_config))
+        client = entry[1]
+    if old_client:
+        try:
+            old_client.close()
+        except Exception:
+            pass
+    return client
 
 
 def update_config_and_reconnect(new_config):
-    """更新配置并重新连接数据库"""
-    global db_client, DB_CONFIG, IMG_BASE_PATH, APP_CONFIG
+    """更新配置并重建连接池
+
+    new_config 只需包含要修改的字段，合并到配置文件中已保存的配置上，未提交的字段（例如配置页面上没有的调优参数）保持不变。
+    """
+    global db_client, db_client_config, DB_CONFIG, IMG_BASE_PATH, APP_CONFIG
     
     # 保存配置
+    new_config = dict(read_saved_config(), **new_config)
     if save_config(new_config):
         APP_CONFIG = new_config
-        DB_CONFIG = {
-            'host': new_config.get('db_host', DEFAULT_CONFIG['db_host']),
-            'user': new_config.get('db_user', DEFAULT_CONFIG['db_user']),
-            'password': new_config.get('db_password', DEFAULT_CONFIG['db_password']),
-            'database': new_config.get('db_database', DEFAULT_CONFIG['db_database'])
-        }
+        DB_CONFIG = db_config_from(new_config)
         IMG_BASE_PATH = new_config.get('img_base_path', DEFAULT_CONFIG['img_base_path'])
         
-        # 关闭旧连接
-        if db_client:
+        # 先创建新连接池再原子替换，正在执行的查询继续使用旧连接，归还时关闭
+        merged_config = dict(DEFAULT_CONFIG, **new_config)
+        new_client = create_db_client(DB_CONFIG, merged_config)
+        with db_client_lock:
+            old_client = db_client
+            db_client = new_client
+            db_client_config = DB_CONFIG
+        if old_client:
             try:
-                db_client.close()
-            except:
+                old_client.close()
+            except Exception:
                 pass
-            db_client = None
-        
-        # 创建新连接
-        get_db_client()
         return True
     return False
 
@@ -219,9 +456,22 @@ def save_config_api():
         if config.get('img_path_mode', 'concat') == 'concat' and 'img_base_path' not in config:
             return jsonify({'success': False, 'error': '使用拼接模式时需要提供 img_base_path'}), 400
         
+        try:
+            normalize_targets(config.get('db_targets'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'db_targets 配置错误: {e}'}), 400
+        
+        # 需要重启才能生效的配置
+        old_config = load_config()
+        restart_required = [key for key in RESTART_CONFIG_KEYS
+                            if key in config and config[key] != old_config.get(key, DEFAULT_CONFIG[key])]
+        
         # 更新配置并重新连接
         if update_config_and_reconnect(config):
-            return jsonify({'success': True, 'message': '配置保存成功'})
+            message = '配置保存成功'
+            if restart_required:
+                message += f"，以下配置需要重启服务后生效: {', '.join(restart_required)}"
+            return jsonify({'success': True, 'message': message, 'restart_required': restart_required})
         else:
             return jsonify({'success': False, 'error': '保存配置失败'}), 500
     
@@ -243,8 +493,8 @@ def test_connection():
             return jsonify({'success': False, 'error': '请填写完整的数据库连接信息'}), 400
         
         # 尝试连接
-        test_client = MySQLClient(host, user, password, database)
-        if test_client.connection:
+        test_client = MySQLClient(host, user, password, database, pool_min=1, pool_max=1)
+        if test_client.pool:
             test_client.close()
             return jsonify({'success': True, 'message': '数据库连接成功'})
         else:
@@ -254,176 +504,983 @@ def test_connection():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """获取查询结果缓存、任务索引缓存、缩略图缓存、图片仓库和导出目录清理的状态"""
+    return jsonify({
+        'success': True,
+        'result_cache': result_cache.stats(),
+        'task_store': task_store.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+        'blobs': blob_store.stats() if blob_store else None,
+        'path_probe': path_probe.stats(),
+        'janitor': export_janitor.stats()
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文本格式的运行指标：各阶段耗时、行数、图片数、导出字节数、连接池和缓存状态"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/db/pool', methods=['GET'])
+def db_pool_stats():
+    """获取数据库连接池状态"""
+    with db_client_lock:
+        client = db_client
+    stats = client.stats() if client else None
+    return jsonify({'success': True, 'pool': stats})
+
+
+def build_img_path_func(columns, app_config):
+    """根据配置和结果列确定图片路径的生成方式，返回作用于单个数据块的函数（无法确定时返回 None）"""
+    img_base_path = app_config.get('img_base_path', DEFAULT_CONFIG['img_base_path'])
+    img_path_mode = app_config.get('img_path_mode', DEFAULT_CONFIG['img_path_mode'])
+    img_path_field = app_config.get('img_path_field', DEFAULT_CONFIG['img_path_field'])
+    img_full_path_field = app_config.get('img_full_path_field', DEFAULT_CONFIG['img_full_path_field'])
+    # 确保基础路径以 / 结尾
+    base_path = img_base_path if img_base_path.endswith('/') or img_base_path.endswith('\\') else img_base_path + '/'
+
+    # 根据配置的路径处理模式来设置图片路径
+    if img_path_mode == 'full_path':
+        # 使用完整路径字段
+        if img_full_path_field in columns:
+            return lambda df: df[img_full_path_field].astype(str)
+        print(f"⚠️ 警告：未找到完整路径字段 '{img_full_path_field}'，尝试使用其他方式")
+        if 'local_pic_url' in columns:
+            return lambda df: df['local_pic_url'].astype(str)
+        if 'img_path' in columns:
+            return lambda df: df['img_path'].astype(str)
+        print(f"❌ 错误：无法确定图片路径，请检查配置")
+    elif img_path_mode == 'concat':
+        # 使用拼接方式
+        if img_path_field in columns:
+            return lambda df: base_path + df[img_path_field].astype(str)
+        print(f"⚠️ 警告：未找到路径字段 '{img_path_field}'，请检查配置")
+    else:
+        print(f"⚠️ 警告：未知的路径处理模式 '{img_path_mode}'，使用默认拼接方式")
+        if 'origin_object_key' in columns:
+            return lambda df: base_path + df['origin_object_key'].astype(str)
+    return None
+
+
+def iter_query_frames(client, sql, sample_size=None, chunk_size=5000, shard_sqls=None, shard_options=None,
+                      sample_seed=42, fanout_sources=None, fanout_options=None, on_rows=None):
+    """流式执行查询，逐块返回 DataFrame
+
+    指定 shard_sqls 时并发执行各时间分片并按时间顺序合并，shard_options 传给 iter_sharded_frames。
+    指定 fanout_sources 时并发查询多个数据库并按到达顺序合并，fanout_options 传给 iter_fanout_frames。
+    指定采样数量时边读取边做蓄水池抽样，内存中只保留样本，读完后作为一个数据块返回；多数据库查询时
+    各数据库分别抽样再合并，样本与数据块的到达顺序无关；
+    on_rows(行数) 在抽样过程中每读取一个数据块调用一次（不抽样时返回的就是读取的数据块，不调用）。
+    """
+    if fanout_sources:
+        source = iter_fanout_frames(fanout_sources, chunk_size, **(fanout_options or {}))
+    elif shard_sqls:
+        source = iter_sharded_frames(client, shard_sqls, chunk_size, **(shard_options or {}))
+    else:
+        source = client.query_chunks(sql, chunk_size)
+    if sample_size is not None and sample_size > 0:
+        if fanout_sources:
+            df = reservoir_sample_by(source, SOURCE_COLUMN, int(sample_size), seed=sample_seed, on_rows=on_rows)
+        else:
+            df = reservoir_sample(source, int(sample_size), seed=sample_seed, on_rows=on_rows)
+        if df is not None:
+            yield df
+    else:
+        yield from source
+
+
+# 随结果返回的图片元数据字段
+RESULT_META_FIELDS = ('c_time', 'check_status', 'detection_result_status', 'manual_check_status')
+
+
+def result_meta(row):
+    # 可为空的整数列读出来是浮点数，状态值按整数保存（'1' 而不是 '1.0'），空值保存为空字符串
+    return {field: normalize_status(row.get(field)) for field in RESULT_META_FIELDS}
+
+
+def write_task_manifest(task_dir, export_mode, images, meta, names=None):
+    """保存任务清单：图片 id → 源图片路径及元数据，以及图片是否已暂存到任务目录
+
+    names 为图片 id → 任务中的文件名（多数据库查询时加了来源前缀），为空时使用源文件名。
+    """
+    manifest = {
+        'mode': export_mode,
+        'images': {str(image_id): img_path for image_id, img_path in images.items()},
+        'meta': {str(image_id): item for image_id, item in meta.items()}
+    }
+    if names:
+        manifest['names'] = {str(image_id): name for image_id, name in names.items()}
+    # 先写临时文件再替换，其他进程不会读到写了一半的清单
+    manifest_path = os.path.join(task_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def load_task_manifest(task_dir):
+    """读取任务清单，旧任务没有清单时返回 None"""
+    manifest_path = os.path.join(task_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['images'] = {int(image_id): img_path for image_id, img_path in manifest.get('images', {}).items()}
+    manifest['meta'] = {int(image_id): item for image_id, item in manifest.get('meta', {}).items()}
+    manifest['names'] = {int(image_id): name for image_id, name in manifest.get('names', {}).items()}
+    return manifest
+
+
+def task_version(task_id):
+    """任务 COCO 文件和清单的修改时间及大小，增量追加改写文件后随之变化"""
+    task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
+    version = []
+    for filename in ('_annotations.coco.json', 'manifest.json'):
+        try:
+            st = os.stat(os.path.join(task_dir, filename))
+            version.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def load_task_index(task_id):
+    """从任务目录构建 TaskIndex，任务或 COCO 文件不存在时返回 None"""
+    task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
+    coco_path = os.path.join(task_dir, '_annotations.coco.json')
+    if not os.path.exists(coco_path):
+        return None
+    # 在读取文件之前取版本，读取期间文件被改写时下次访问会重新加载
+    version = task_version(task_id)
+    
+    manifest = load_task_manifest(task_dir)
+    if manifest is None:
+        # 旧任务没有清单，读取查询结果中的图片路径和元数据列
+        manifest = {'mode': 'copy', 'images': {}, 'meta': {}}
+        if has_table(task_dir):
+            try:
+                df = read_task_table(task_dir, columns=('img_path',) + RESULT_META_FIELDS)
+                for idx, row in df.iterrows():
+                    img_path = row.get('img_path', '')
+                    manifest['meta'][int(idx)] = result_meta(row)
+                    if pd.notna(img_path) and img_path:
+                        manifest['images'][int(idx)] = str(img_path)
+            except Exception as e:
+                print(f"⚠️ 读取CSV文件警告: {e}")
+    
+    with open(coco_path, 'r', encoding='utf-8') as f:
+        coco_data = json.load(f)
+    
+    return TaskIndex(task_id, coco_data, manifest, nbytes=estimate_index_bytes(task_dir), version=version)
+
+
+def estimate_index_bytes(task_dir):
+    """粗略估算任务索引的内存占用：Python 对象约为 JSON 文本的数倍（紧凑格式的 COCO 文件倍数更高）"""
+    nbytes = 0
+    for filename, factor in (('_annotations.coco.json', 8), ('manifest.json', 4)):
+        path = os.path.join(task_dir, filename)
+        if os.path.exists(path):
+            nbytes += os.path.getsize(path) * factor
+    return nbytes
+
+
+_coco_parse_executor = None
+
+
+def get_coco_parse_executor(app_config):
+    """按配置创建用于并行解析 infer_raw_result 的进程池（未配置时返回 None）"""
+    global _coco_parse_executor
+    workers = int(app_config.get('coco_parse_workers', DEFAULT_CONFIG['coco_parse_workers']) or 0)
+    if workers <= 1:
+        return None
+    if _coco_parse_executor is None:
+        _coco_parse_executor = ProcessPoolExecutor(max_workers=workers)
+    return _coco_parse_executor
+
+
+# 任务索引缓存（查询结果、选择导出和 COCO 接口共用）
+task_store = TaskStore(
+    load_task_index,
+    max_bytes=int(APP_CONFIG.get('task_cache_bytes', DEFAULT_CONFIG['task_cache_bytes'])),
+    version=task_version
+)
+
+# 查询结果缓存（相同 SQL 和配置直接复用已有任务）
+result_cache = ResultCache(
+    ttl=float(APP_CONFIG.get('result_cache_ttl', DEFAULT_CONFIG['result_cache_ttl'])),
+    max_bytes=int(APP_CONFIG.get('result_cache_bytes', DEFAULT_CONFIG['result_cache_bytes']))
+)
+
+
+def task_dir_bytes(task_dir):
+    """任务目录占用的磁盘空间"""
+    nbytes = 0
+    for root, _, files in os.walk(task_dir):
+        for filename in files:
+            try:
+                nbytes += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return nbytes
+
+
+def is_reusable_task(task_id):
+    """缓存的任务仍可复用：任务仍在执行或已成功完成，结果文件没有被删除，且没有被增量追加过
+
+    追加时只清理了本进程的结果缓存，其他 worker 进程的缓存通过 query.json 中的追加标记判断。
+    """
+    info = load_query_info(os.path.join(app.config['UPLOAD_FOLDER'], task_id))
+    if info is not None and info.get('appended'):
+        return False
+    state = job_manager.get_state(task_id)
+    if state is not None and state['status'] in ('pending', 'running'):
+        return True
+    if state is not None and state['status'] == 'failed':
+        return False
+    return os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], task_id, '_annotations.coco.json'))
+
+
+def is_active_task(task_id):
+    """任务仍在执行（包括其他 worker 进程中的任务）"""
+    state = job_manager.get_state(task_id)
+    return state is not None and state['status'] in ('pending', 'running')
+
+
+def on_task_evicted(task_id):
+    """任务目录被清理前，移除内存中的任务索引和指向该任务的结果缓存"""
+    task_store.invalidate(task_id)
+    result_cache.discard_task(task_id)
+
+
+# exports/ 后台清理（磁盘配额、最长保留时间、旧版导出留下的临时文件）
+export_janitor = ExportJanitor(
+    app.config['UPLOAD_FOLDER'],
+    max_bytes=int(APP_CONFIG.get('export_max_bytes', DEFAULT_CONFIG['export_max_bytes'])),
+    max_age=float(APP_CONFIG.get('export_max_age', DEFAULT_CONFIG['export_max_age'])),
+    interval=float(APP_CONFIG.get('janitor_interval', DEFAULT_CONFIG['janitor_interval'])),
+    blob_store=blob_store,
+    is_active=is_active_task,
+    on_evict=on_task_evicted
+)
+
+
+# 运行指标（/api/metrics 以 Prometheus 文本格式输出）
+STAGE_SECONDS = REGISTRY.histogram('picture_stage_seconds', '查询任务和接口各阶段的耗时（秒）', ('operation', 'stage'))
+REQUEST_SECONDS = REGISTRY.histogram('picture_request_seconds', '接口处理耗时（秒，不含流式响应的传输）', ('endpoint', 'status'))
+QUERY_JOBS = REGISTRY.counter('picture_query_jobs_total', '结束的查询任务数', ('status',))
+QUERY_ROWS = REGISTRY.counter('picture_query_rows_total', '查询读取的行数')
+IMAGES_STAGED = REGISTRY.counter('picture_images_staged_total', '暂存的图片数（按结果类型，missing 为图片不存在）', ('result',))
+EXPORT_BYTES = REGISTRY.counter('picture_export_bytes_total', '导出下载的字节数', ('format',))
+
+
+def db_pool_metrics():
+    client = db_client
+    stats = client.stats() if hasattr(client, 'stats') else None
+    if not stats:
+        return None
+    return {(key,): int(value) for key, value in stats.items() if isinstance(value, (int, float))}
+
+
+def cache_metrics(field):
+    caches = {'result': result_cache.stats(), 'task_index': task_store.stats(), 'thumbnail': thumbnail_cache.stats(),
+              'path_probe': path_probe.stats()}
+    return {(name,): stats[field] for name, stats in caches.items() if field in stats}
+
+
+REGISTRY.callback('picture_images_copied_bytes_total', '暂存图片时实际复制的字节数（链接的不计入）',
+                  lambda: image_stager.bytes_copied, type_name='counter')
+REGISTRY.callback('picture_jobs', '内存中的查询任务数', lambda: {(status,): n for status, n in job_manager.counts().items()},
+                  ('status',))
+REGISTRY.callback('picture_db_pool', '数据库连接池状态（连接数、空闲数、等待/超时次数等）', db_pool_metrics, ('stat',))
+REGISTRY.callback('picture_cache_bytes', '各缓存占用的字节数', lambda: cache_metrics('bytes'), ('cache',))
+REGISTRY.callback('picture_cache_max_bytes', '各缓存的字节数上限', lambda: cache_metrics('max_bytes'), ('cache',))
+REGISTRY.callback('picture_cache_hits_total', '缓存命中次数', lambda: cache_metrics('hits'), ('cache',), 'counter')
+REGISTRY.callback('picture_cache_misses_total', '缓存未命中次数', lambda: cache_metrics('misses'), ('cache',), 'counter')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.stopwatch = Stopwatch(STAGE_SECONDS, request.endpoint)
+
+
+@app.after_request
+def add_server_timing(response):
+    """记录接口耗时并通过 Server-Timing 头返回各阶段耗时（查询进度接口附带后台任务的各阶段耗时）"""
+    stopwatch = g.get('stopwatch')
+    if stopwatch is None:
+        return response
+    total = time.perf_counter() - g.request_started
+    stopwatch.flush()
+    REQUEST_SECONDS.observe(total, endpoint=request.endpoint or 'unknown', status=response.status_code)
+    parts = [server_timing(stopwatch.snapshot()), server_timing(g.get('job_timings') or {}, prefix='job-'),
+             f'total;dur={total * 1000:.1f}']
+    response.headers['Server-Timing'] = ', '.join(part for part in parts if part)
+    return response
+
+
+def metered_stream(chunks, fmt):
+    """流式下载计量：传输结束（或中断）后记录字节数和传输耗时"""
+    operation = request.endpoint
+    start = time.perf_counter()
+    nbytes = 0
+    try:
+        for chunk in chunks:
+            nbytes += len(chunk)
+            yield chunk
+    finally:
+        EXPORT_BYTES.inc(nbytes, format=fmt)
+        STAGE_SECONDS.observe(time.perf_counter() - start, operation=operation, stage='stream')
+
+
+def task_not_found(task_id, error):
+    """任务目录不存在时的响应：已被清理的任务返回 410“任务已过期”，否则返回 404"""
+    if export_janitor.is_expired(task_id):
+        return jsonify({'success': False, 'error': '任务已过期', 'expired': True}), 410
+    return jsonify({'success': False, 'error': error}), 404
+
+
+def run_query_job(job, sql, sample_size, app_config, export_mode=None, cache_key=None, shard_sqls=None,
+                  query_info=None, append=None, targets=None):
+    """在后台线程中执行查询任务：查询、写 CSV、复制图片、生成 COCO 并整理返回数据
+
+    export_mode 为 'lazy' 时只记录清单不暂存图片，导出时直接从原始路径读取。
+    cache_key 不为空时，任务完成后在结果缓存中记录任务目录的大小。
+    shard_sqls 为按时间分片渲染的 SQL 列表，各分片并发执行后按时间顺序合并。
+    query_info 为 SQL 模板和时间范围，与结果行数、高水位一起保存到 query.json，用于之后的增量追加。
+    append 为已有任务的 query.json 内容时，把查询结果追加到该任务（图片 id 接续已有结果）。
+    targets 为 db_targets 中的数据库名称列表时，同一 SQL 在这些数据库上并发执行，结果带 source 列，
+    图片文件名加来源前缀；某个数据库失败时其他数据库的结果照常保存，失败的数据库记录在任务的 message 中。
+    各阶段耗时记录在任务进度（timings）和 picture_stage_seconds 指标中。
+    """
+    watch = Stopwatch(STAGE_SECONDS, 'query', on_add=job.add_timing)
+    try:
+        _execute_query_job(job, watch, sql, sample_size, app_config, export_mode, cache_key, shard_sqls,
+                           query_info, append, targets)
+    finally:
+        watch.flush()
+        # 抛出异常时任务仍是 running 状态，随后由 JobManager 标记为失败
+        QUERY_JOBS.inc(status='done' if job.status == 'done' else 'failed')
+
+
+def _execute_query_job(job, watch, sql, sample_size, app_config, export_mode, cache_key, shard_sqls,
+                       query_info, append, targets):
+    chunk_size = int(app_config.get('query_chunk_size', DEFAULT_CONFIG['query_chunk_size']))
+    export_mode = export_mode or app_config.get('export_mode', DEFAULT_CONFIG['export_mode'])
+    time_field = app_config.get('tail_time_field', DEFAULT_CONFIG['tail_time_field'])
+    key_field = app_config.get('tail_key_field', DEFAULT_CONFIG['tail_key_field'])
+    task_id = job.task_id
+    base_count = append['rows'] if append else 0
+    job.base_count = base_count
+    
+    target_configs = {}
+    failed_targets = []
+    
+    def count_fetched_rows(rows):
+        job.add_progress(rows_fetched=rows)
+        QUERY_ROWS.inc(rows)
+    
+    # 执行流式查询，先取第一个数据块以便及时发现 SQL 或连接错误
+    job.set_stage('fetching')
+    try:
+        fanout_sources = None
+        fanout_options = None
+        if targets:
+            # 每个数据库使用自己的连接池，并发查询
+            target_configs = normalize_targets(app_config.get('db_targets', DEFAULT_CONFIG['db_targets']))
+            fanout_sources = [(name, get_target_client(name, target_configs[name], app_config), sql) for name in targets]
+            job.set_progress(targets_total=len(targets), targets_done=0)
+            
+            def on_source_done(name, rows, error):
+                job.add_progress(targets_done=1)
+                if error is not None:
+                    failed_targets.append(name)
+            
+            fanout_options = {'on_source_done': on_source_done}
+            client = None
+        else:
+            client = get_db_client()
+        shard_options = None
+        if shard_sqls:
+            # 每个分片占用一个连接，并发数不超过连接池上限
+            shard_workers = int(app_config.get('query_shard_workers', DEFAULT_CONFIG['query_shard_workers']))
+            pool = getattr(client, 'pool', None)
+            if pool is not None:
+                shard_workers = min(shard_workers, pool.max_size)
+            job.set_progress(shards_total=len(shard_sqls), shards_done=0)
+            shard_options = {
+                'max_workers': shard_workers,
+                'retries': int(app_config.get('query_shard_retries', DEFAULT_CONFIG['query_shard_retries'])),
+                'sort_column': app_config.get('query_shard_time_field', DEFAULT_CONFIG['query_shard_time_field']),
+                'on_shard_done': lambda shard_idx, rows: job.add_progress(shards_done=1)
+            }
+        sample_seed = int(app_config.get('sample_seed', DEFAULT_CONFIG['sample_seed']))
+        # 蓄水池抽样时只返回样本，读取的行数在抽样过程中统计
+        sampling = bool(sample_size and sample_size > 0)
+        # fetch 阶段包括等待数据库返回数据块、分片合并和蓄水池抽样
+        frames = watch.iter('fetch', iter_query_frames(client, sql, sample_size, chunk_size, shard_sqls, shard_options, sample_seed,
+                                                       fanout_sources, fanout_options,
+                                                       on_rows=count_fetched_rows if sampling else None))
+        first_df = next(frames, None)
+    except Exception as e:
+        print(f"❌ 查询失败: {e}")
+        job.fail('查询失败，请检查 SQL 语句和数据库连接')
+        return
+    
+    if first_df is None or first_df.empty:
+        # 增量追加没有新数据时，已有结果保持不变
+        job.finish('没有新数据' if append else '查询结果为空')
+        return
+    
+    # 处理图片路径（使用提交任务时的配置，多数据库查询时各数据库可以有自己的 img_base_path）
+    img_path_funcs = {}
+    
+    def img_path_func_for(source, columns):
+        if source not in img_path_funcs:
+            source_config = app_config
+            if source is not None and 'img_base_path' in target_configs[source]:
+                source_config = dict(app_config, img_base_path=target_configs[source]['img_base_path'])
+            img_path_funcs[source] = build_img_path_func(columns, source_config)
+        return img_path_funcs[source]
+    
+    def img_paths_for(df):
+        """返回数据块的图片路径，无法确定时返回 None；抽样结果中混有多个数据库的行，按来源分组生成"""
+        if not targets:
+            img_path_func = img_path_func_for(None, df.columns)
+            return img_path_func(df) if img_path_func is not None else None
+        parts = []
+        for source, group in df.groupby(SOURCE_COLUMN, sort=False):
+            img_path_func = img_path_func_for(source, df.columns)
+            if img_path_func is not None:
+                parts.append(img_path_func(group))
+        return pd.concat(parts).reindex(df.index) if parts else None
+    
+    task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
+    os.makedirs(task_dir, exist_ok=True)
+    table_writer = TaskTableWriter(task_dir, app_config.get('task_storage', DEFAULT_CONFIG['task_storage']),
+                                   append=bool(append))
+    
+    # 获取配置的 id2name
+    id2name_config = app_config.get('id2name', DEFAULT_CONFIG['id2name'])
+    parse_executor = get_coco_parse_executor(app_config)
+    categories = df2coco(first_df.iloc[:0], id2name_config)['categories']
+    coco_ok = True
+    # COCO 文件随数据块增量写出（紧凑格式），不在最后整体序列化
+    coco_path = os.path.join(task_dir, '_annotations.coco.json')
+    coco_writer = CocoWriter(coco_path, categories)
+    
+    # 逐块处理：生成图片路径、保存查询结果、暂存图片、转换 COCO、收集返回数据
+    manifest_images = {}
+    manifest_meta = {}
+    manifest_names = {}
+    high_water = None
+    if append:
+        # 已有的图片和标注按行复制到新文件开头，只转换新增的行；清单在已有内容上补充
+        with watch.time('coco'):
+            coco_writer.extend_from(coco_path)
+        existing = load_task_manifest(task_dir)
+        export_mode = existing['mode']
+        manifest_images = existing['images']
+        manifest_meta = existing['meta']
+        manifest_names = existing['names']
+        high_water = tuple(append['high_water'])
+    
+    def record_staged(result, src):
+        IMAGES_STAGED.inc(result=result)
+        # 缺失的图片在暂存前已由 path_probe 记录
+        if result in (COPIED, LINKED, SKIPPED):
+            job.add_progress(**{f'images_{result}': 1})
+    
+    try:
+        for chunk_idx, df in enumerate(itertools.chain([first_df], frames)):
+            if base_count:
+                df.index = df.index + base_count
+            high_water = high_water_mark(df, time_field, key_field, high_water)
+            img_paths = img_paths_for(df)
+            if img_paths is not None:
+                df['img_path'] = img_paths
+            if targets and 'img_path' in df.columns:
+                # 不同产线可能有同名图片，任务中的文件名加上来源前缀
+                df['img_name'] = [source_filename(source, img_path) if isinstance(img_path, str) and img_path else ''
+                                  for source, img_path in zip(df[SOURCE_COLUMN], df['img_path'])]
+                manifest_names.update((int(idx), name) for idx, name in zip(df.index, df['img_name']) if name)
+            if not sampling:
+                count_fetched_rows(len(df))
+            
+            # 保存查询结果（Arrow 格式每块一个文件，CSV 格式追加写入）
+            with watch.time('table'):
+                table_writer.write(df)
+            
+            missing = ()
+            if 'img_path' in df.columns:
+                manifest_images.update(
+                    (int(idx), img_path) for idx, img_path in zip(df.index, df['img_path'])
+                    if isinstance(img_path, str) and img_path
+                )
+                # 按目录批量检查图片是否存在，缺失的图片在暂存之前就出现在任务状态中
+                with watch.time('probe'):
+                    missing = set(path_probe.probe(df['img_path'].tolist()))
+                job.add_missing(path for path in df['img_path'] if path in missing)
+            
+            # 并行暂存图片到导出目录（与COCO文件同一级），同一文件系统时使用链接
+            if export_mode != 'lazy' and 'img_path' in df.columns:
+                with watch.time('images'):
+                    stats = image_stager.stage(df['img_path'].tolist(), task_dir, on_result=record_staged,
+                                               missing=missing,
+                                               names=df['img_name'].tolist() if 'img_name' in df.columns else None)
+                if stats[FAILED]:
+                    print(f"⚠️ {stats[FAILED]} 张图片暂存失败")
+            
+            # 直接从 DataFrame 转换为 COCO 格式（不再回读 CSV）
+            if coco_ok:
+                try:
+                    with watch.time('coco'):
+                        part = df2coco(df, id2name_config, parse_executor)
+                        coco_writer.write_images(part['images'])
+                        coco_writer.write_annotations(part['annotations'])
+                except Exception as e:
+                    if append:
+                        raise  # 追加时 COCO 必须与查询结果一致，整体失败并撤销
+                    print(f"⚠️ COCO 转换警告: {e}")
+                    coco_writer.abort()
+                    coco_ok = False
+            
+            # 准备返回数据（只返回基本信息，不包含完整数据），作为部分结果立即可见
+            with watch.time('items'):
+                chunk_items = []
+                for idx, row in df.iterrows():
+                    img_path = row.get('img_path', '')
+                    img_name = row.get('img_name') or (os.path.basename(img_path) if img_path else '')
+                    meta = result_meta(row)
+                    manifest_meta[int(idx)] = meta
+                    chunk_items.append(dict({
+                        'id': int(idx),
+                        'img_name': img_name,
+                        'img_path': img_path,
+                        'annotations': []
+                    }, **meta))
+                job.add_items(chunk_items)
+    except Exception:
+        if coco_ok:
+            coco_writer.abort()
+        if append:
+            # 撤销追加到查询结果中的数据块，已有任务保持原样，可以重新追加
+            table_writer.rollback()
+        raise
+    
+    with watch.time('manifest'):
+        write_task_manifest(task_dir, export_mode, manifest_images, manifest_meta, manifest_names)
+    
+    # 拼接 COCO 文件
+    job.set_stage('coco')
+    if coco_ok:
+        try:
+            with watch.time('coco'):
+                coco_writer.close()
+            job.set_progress(coco_built=True)
+        except Exception as e:
+            print(f"⚠️ COCO 保存警告: {e}")
+            coco_ok = False
+    
+    # 查询过程中不在内存中保留完整的 COCO 数据，任务索引在第一次访问时从写出的 COCO 文件和清单构建
+    task_store.invalidate(task_id)
+    if query_info is not None:
+        # 抽样的结果不是完整的查询结果，不能在其后追加
+        save_query_info(task_dir, dict(
+            query_info,
+            export_mode=export_mode,
+            rows=len(manifest_meta),
+            high_water=high_water,
+            # 多数据库合并的结果没有统一的高水位
+            tailable=bool(coco_ok and high_water is not None and not query_info.get('sampled')
+                          and not query_info.get('targets'))
+        ))
+    if cache_key and failed_targets:
+        # 缺少部分数据库的结果，不作为该查询的缓存结果复用
+        result_cache.discard_task(task_id)
+    elif cache_key:
+        result_cache.update_size(cache_key, task_id, task_dir_bytes(task_dir))
+    # 没有生成任务索引时保留部分结果，否则完成后从任务索引读取
+    job.finish(f"部分数据库查询失败: {', '.join(failed_targets)}" if failed_targets else None, keep_items=not coco_ok)
+
+
+def load_append_info(task_id):
+    """检查任务能否增量追加，返回 (query.json 内容, None) 或 (None, 错误响应)"""
+    task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
+    if not os.path.isdir(task_dir):
+        return None, task_not_found(task_id, '要追加的任务不存在')
+    if is_active_task(task_id):
+        return None, (jsonify({'success': False, 'error': '任务正在执行，请完成后再追加'}), 409)
+    info = load_query_info(task_dir)
+    if info is None or not info.get('tailable') or load_task_manifest(task_dir) is None:
+        # 旧任务、抽样结果或查询结果中没有时间/主键字段的任务无法确定从哪里继续
+        return None, (jsonify({'success': False, 'error': '该任务不支持增量追加'}), 400)
+    return info, None
+
+
 @app.route('/api/query', methods=['POST'])
 def query_database():
-    """执行 SQL 查询"""
+    """提交 SQL 查询任务，立即返回 task_id，进度通过 /api/query/<task_id> 轮询"""
     try:
         data = request.json
         sql_template = data.get('sql', '')
         start_time = data.get('start_time', '')
         end_time = data.get('end_time', '')
         sample_size = data.get('sample_size', None)  # 随机采样数量
+        export_mode = data.get('export_mode', None)  # 'copy' 或 'lazy'，默认使用配置
+        no_cache = bool(data.get('no_cache', False))  # 跳过结果缓存，强制重新查询
+        shards = data.get('shards', None)  # 时间分片数，默认使用配置
+        sample_mode = data.get('sample_mode', None)  # 'reservoir' 或 'sql'，默认使用配置
+        append_to = data.get('append_to', None)  # 已有任务的 task_id：只查询比该任务更新的行并追加到该任务
+        targets = data.get('targets', None)  # db_targets 中的数据库名称列表，同时查询这些数据库；默认只查询默认数据库
+        
+        if append_to:
+            return append_query(append_to, sql_template, start_time, end_time)
         
         if not sql_template:
             return jsonify({'success': False, 'error': 'SQL 查询语句不能为空'}), 400
         
-        # 替换 SQL 中的时间变量
-        sql = sql_template.replace('${START_TIME}', start_time).replace('${END_TIME}', end_time)
+        if export_mode not in (None, 'copy', 'lazy'):
+            return jsonify({'success': False, 'error': f'未知的导出模式: {export_mode}'}), 400
         
-        # 执行查询
-        client = get_db_client()
-        df = client.query(sql)
-        
-        if df is None:
-            return jsonify({'success': False, 'error': '查询失败，请检查 SQL 语句和数据库连接'}), 500
-        
-        if df.empty:
-            return jsonify({'success': True, 'data': [], 'count': 0, 'message': '查询结果为空'})
-        
-        # 随机采样（如果指定了采样数量）
-        if sample_size is not None and sample_size > 0:
-            sample_size = int(sample_size)
-            if sample_size < len(df):
-                df = df.sample(n=sample_size, random_state=42).reset_index(drop=True)
-        
-        # 处理图片路径（使用最新配置）
-        global IMG_BASE_PATH
-        APP_CONFIG = load_config()
-        IMG_BASE_PATH = APP_CONFIG.get('img_base_path', DEFAULT_CONFIG['img_base_path'])
-        img_path_mode = APP_CONFIG.get('img_path_mode', DEFAULT_CONFIG['img_path_mode'])
-        img_path_field = APP_CONFIG.get('img_path_field', DEFAULT_CONFIG['img_path_field'])
-        img_full_path_field = APP_CONFIG.get('img_full_path_field', DEFAULT_CONFIG['img_full_path_field'])
-        
-        # 根据配置的路径处理模式来设置图片路径
-        if img_path_mode == 'full_path':
-            # 使用完整路径字段
-            if img_full_path_field in df.columns:
-                df['img_path'] = df[img_full_path_field].astype(str)
-            else:
-                print(f"⚠️ 警告：未找到完整路径字段 '{img_full_path_field}'，尝试使用其他方式")
-                if 'local_pic_url' in df.columns:
-                    df['img_path'] = df['local_pic_url'].astype(str)
-                elif 'img_path' in df.columns:
-                    df['img_path'] = df['img_path'].astype(str)
-                else:
-                    print(f"❌ 错误：无法确定图片路径，请检查配置")
-        elif img_path_mode == 'concat':
-            # 使用拼接方式
-            if img_path_field in df.columns:
-                # 确保基础路径以 / 结尾
-                base_path = IMG_BASE_PATH if IMG_BASE_PATH.endswith('/') or IMG_BASE_PATH.endswith('\\') else IMG_BASE_PATH + '/'
-                df['img_path'] = base_path + df[img_path_field].astype(str)
-            else:
-                print(f"⚠️ 警告：未找到路径字段 '{img_path_field}'，请检查配置")
-        else:
-            print(f"⚠️ 警告：未知的路径处理模式 '{img_path_mode}'，使用默认拼接方式")
-            if 'origin_object_key' in df.columns:
-                base_path = IMG_BASE_PATH if IMG_BASE_PATH.endswith('/') or IMG_BASE_PATH.endswith('\\') else IMG_BASE_PATH + '/'
-                df['img_path'] = base_path + df['origin_object_key'].astype(str)
+        if sample_size is not None:
+            try:
+                sample_size = int(sample_size)
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': f'采样数量必须是整数: {sample_size}'}), 400
+            if sample_size <= 0:
+                sample_size = None
+        sampled = bool(sample_size)
         
-        # 生成唯一任务 ID
-        task_id = str(uuid.uuid4())
-        task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
-        os.makedirs(task_dir, exist_ok=True)
+        # 替换 SQL 中的时间变量
+        sql = sql_template.replace('${START_TIME}', start_time).replace('${END_TIME}', end_time)
         
-        # 保存 CSV
-        csv_path = os.path.join(task_dir, 'result.csv')
-        df.to_csv(csv_path, index=False, encoding='utf-8')
+        app_config = load_config()
+        sample_mode = sample_mode or app_config.get('sample_mode', DEFAULT_CONFIG['sample_mode'])
+        if sample_mode not in SAMPLE_MODES:
+            return jsonify({'success': False, 'error': f'未知的采样方式: {sample_mode}'}), 400
         
-        # 转换为 COCO 格式
-        coco_path = os.path.join(task_dir, '_annotations.coco.json')
+        # 按时间范围拆分为多个分片并发查询（模板中没有时间变量或时间无法解析时不分片）
         try:
-            # 获取配置的 id2name
-            APP_CONFIG = load_config()
-            id2name_config = APP_CONFIG.get('id2name', DEFAULT_CONFIG['id2name'])
-            csv2coco(csv_path, coco_path, id2name_config)
-        except Exception as e:
-            print(f"⚠️ COCO 转换警告: {e}")
+            shards = int(shards if shards is not None else app_config.get('query_shards', DEFAULT_CONFIG['query_shards']))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': f'分片数必须是整数: {shards}'}), 400
+        shard_sqls = render_shard_sqls(sql_template, start_time, end_time, shards,
+                                       app_config.get('query_shard_time_field', DEFAULT_CONFIG['query_shard_time_field']))
         
-        # 复制所有图片到导出目录（与COCO文件同一级）
-        try:
-            for idx, row in df.iterrows():
-                img_path = row.get('img_path', '')
-                if pd.isna(img_path) or not img_path:
-                    continue
-                
-                # 检查源文件是否存在
-                if not os.path.exists(img_path):
-                    print(f"⚠️ 图片文件不存在: {img_path}")
-                    continue
-                
-                # 获取图片文件名
-                img_name = os.path.basename(img_path)
-                # 复制图片到导出目录
-                dest_img_path = os.path.join(task_dir, img_name)
-                shutil.copy2(img_path, dest_img_path)
-        except Exception as e:
-            print(f"⚠️ 复制图片警告: {e}")
+        target_fingerprint = None
+        if targets:
+            if isinstance(targets, str):
+                targets = [targets]
+            try:
+                configured_targets = normalize_targets(app_config.get('db_targets', DEFAULT_CONFIG['db_targets']))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': f'db_targets 配置错误: {e}'}), 400
+            targets = list(dict.fromkeys(str(target) for target in targets))
+            unknown = [target for target in targets if target not in configured_targets]
+            if unknown:
+                return jsonify({'success': False, 'error': f"未知的数据库目标: {', '.join(unknown)}"}), 400
+            # 每个数据库各执行一个查询，不再按时间分片
+            shard_sqls = None
+            target_fingerprint = [dict({key: value for key, value in configured_targets[target].items() if key != 'password'},
+                                       name=target) for target in targets]
         
-        # 加载COCO数据用于返回标注信息
-        coco_data = None
-        try:
-            with open(coco_path, 'r', encoding='utf-8') as f:
-                coco_data = json.load(f)
-        except Exception as e:
-            print(f"⚠️ 加载COCO数据警告: {e}")
+        # 数据库端采样：只传输样本行，整体抽样因此不再分片
+        if sample_size and sample_mode == 'sql':
+            sql = sample_sql(sql, sample_size, int(app_config.get('sample_seed', DEFAULT_CONFIG['sample_seed'])))
+            shard_sqls = None
+            if not targets:
+                sample_size = None  # 多数据库查询时各数据库分别抽样，合并后再抽取 sample_size 行
         
-        # 准备返回数据（只返回基本信息，不包含完整数据）
-        result_data = []
-        for idx, row in df.iterrows():
-            img_path = row.get('img_path', '')
-            img_name = os.path.basename(img_path) if img_path else ''
-            
-            # 获取该图片的标注信息
-            annotations = []
-            if coco_data:
-                image_id = int(idx)
-                for ann in coco_data.get('annotations', []):
-                    if ann.get('image_id') == image_id:
-                        annotations.append({
-                            'bbox': ann.get('bbox', []),
-                            'category': ann.get('category', ''),
-                            'category_id': ann.get('category_id', 0),
-                            'score': ann.get('score', 0)
-                        })
-            
-            result_data.append({
-                'id': int(idx),
-                'img_name': img_name,
-                'img_path': img_path,
-                'c_time': str(row.get('c_time', '')),
-                'check_status': str(row.get('check_status', '')),
-                'detection_result_status': str(row.get('detection_result_status', '')),
-                'manual_check_status': str(row.get('manual_check_status', '')),
-                'annotations': annotations
-            })
+        cache_key = None
+        if result_cache.enabled:
+            resolved_mode = export_mode or app_config.get('export_mode', DEFAULT_CONFIG['export_mode'])
+            cache_key = make_cache_key(sql, app_config, sample_size, resolved_mode, len(shard_sqls) if shard_sqls else None,
+                                       target_fingerprint)
+            # 相同查询直接复用已有任务（包括仍在执行的任务），不再重复查询和生成文件
+            with g.stopwatch.time('cache'):
+                cached_task_id = None if no_cache else result_cache.get(cache_key, is_valid=is_reusable_task)
+            if cached_task_id:
+                export_janitor.touch(cached_task_id)
+                state = job_manager.get_state(cached_task_id)
+                return jsonify({
+                    'success': True,
+                    'task_id': cached_task_id,
+                    'status': state['status'] if state else 'done',
+                    'cached': True
+                })
+        
+        # 生成唯一任务 ID 并提交到后台执行（使用最新配置）
+        task_id = str(uuid.uuid4())
+        if cache_key:
+            result_cache.put(cache_key, task_id)
+        query_info = {
+            'sql_template': sql_template,
+            'start_time': start_time,
+            'end_time': end_time,
+            'sampled': sampled,
+            'targets': targets or None
+        }
+        job = job_manager.submit(task_id, run_query_job, sql, sample_size, app_config, export_mode, cache_key, shard_sqls,
+                                 query_info, None, targets or None)
         
         return jsonify({
             'success': True,
-            'data': result_data,
-            'count': len(result_data),
-            'task_id': task_id
-        })
+            'task_id': task_id,
+            'status': job.status,
+            'cached': False
+        }), 202
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def append_query(task_id, sql_template, start_time, end_time):
+    """提交增量追加任务：按任务保存的高水位只查询更新的行，追加到原任务
+
+    未指定的 SQL 模板和开始时间沿用原任务，结束时间默认为当前时间。
+    """
+    info, error = load_append_info(task_id)
+    if error is not None:
+        return error
+    
+    sql_template = sql_template or info['sql_template']
+    start_time = start_time or info['start_time']
+    end_time = end_time or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    sql = sql_template.replace('${START_TIME}', start_time).replace('${END_TIME}', end_time)
+    
+    app_config = load_config()
+    time_field = app_config.get('tail_time_field', DEFAULT_CONFIG['tail_time_field'])
+    key_field = app_config.get('tail_key_field', DEFAULT_CONFIG['tail_key_field'])
+    sql = tail_sql(sql, time_field, key_field, info['high_water'])
+    
+    # 追加后任务内容改变，原来指向该任务的缓存结果不再对应其查询；
+    # 先在 query.json 中记录追加，其他 worker 进程的结果缓存也不再复用该任务
+    result_cache.discard_task(task_id)
+    save_query_info(os.path.join(app.config['UPLOAD_FOLDER'], task_id), dict(info, appended=True))
+    query_info = {'sql_template': sql_template, 'start_time': start_time, 'end_time': end_time, 'sampled': False,
+                  'appended': True}
+    job = job_manager.submit(task_id, run_query_job, sql, None, app_config, info['export_mode'], None, None,
+                             query_info, info)
+    job.base_count = info['rows']
+    
+    return jsonify({
+        'success': True,
+        'task_id': task_id,
+        'status': job.status,
+        'cached': False,
+        'appended': True,
+        'base_count': info['rows']
+    }), 202
+
+
+@app.route('/api/query/<task_id>', methods=['GET'])
+def query_status(task_id):
+    """获取查询任务的进度和结果，offset 指定只返回该位置之后的结果
+
+    missing 为本次查询中不存在的全部图片路径（missing=0 时不返回，轮询进度时可减小响应）。
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', None, type=int)
+    limit = max(limit, 0) if limit is not None else None
+    
+    job = job_manager.get(task_id)
+    if job is None:
+        # 其他 worker 进程中的任务：从共享存储返回状态和进度（部分结果在任务完成后从任务索引读取）
+        state = job_manager.get_state(task_id)
+        if state is not None and state['status'] != 'done':
+            state['success'] = state['status'] != 'failed'
+            g.job_timings = state['timings']
+            return jsonify(state)
+        
+        # 任务状态已过期（例如从结果缓存复用的旧任务），从任务索引返回结果
+        with g.stopwatch.time('index'):
+            index = task_store.get(task_id)
+        if index is None:
+            return task_not_found(task_id, '查询任务不存在')
+        export_janitor.touch(task_id)
+        image_ids = index.image_ids
+        return jsonify({
+            'success': True,
+            'task_id': task_id,
+            'status': 'done',
+            'stage': 'finished',
+            'progress': {},
+            'count': len(image_ids),
+            'offset': offset,
+            'data': index.page(offset, len(image_ids) if limit is None else limit),
+            'error': None,
+            'message': None,
+            'elapsed': 0
+        })
+    
+    include_missing = request.args.get('missing', 1, type=int) != 0
+    with g.stopwatch.time('snapshot'):
+        snapshot = job.snapshot(offset=offset, limit=limit, include_missing=include_missing)
+    if snapshot['status'] == 'done' and limit != 0:
+        # 完成的任务不再保留部分结果，从任务索引读取
+        with g.stopwatch.time('index'):
+            index = task_store.get(task_id)
+        if index is not None:
+            snapshot['offset'] = offset
+            snapshot['data'] = index.page(offset, len(index.image_ids) if limit is None else limit)
+    snapshot['success'] = snapshot['status'] != 'failed'
+    g.job_timings = snapshot['timings']
+    return jsonify(snapshot)
+
+
+@app.route('/api/tasks/<task_id>/items', methods=['GET'])
+def get_task_items(task_id):
+    """分页获取任务结果（包含标注），已完成的任务从任务索引读取，运行中的任务返回已产生的部分结果"""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 200, type=int), 1), 1000)
+    
+    job = job_manager.get(task_id)
+    state = job_manager.get_state(task_id) if job is None else None
+    if state is not None and state['status'] in ('pending', 'running'):
+        # 其他 worker 进程中仍在执行的任务：新查询完成后才能分页读取，
+        # 增量追加时只返回追加前已有的结果
+        index = task_store.get(task_id)
+        return jsonify({
+            'success': True,
+            'task_id': task_id,
+            'offset': offset,
+            'limit': limit,
+            'count': state['count'],
+            'complete': False,
+            'data': index.page(offset, limit) if index is not None else []
+        })
+    if job is None or job.status == 'done':
+        index = task_store.get(task_id)
+        if index is not None:
+            export_janitor.touch(task_id)
+            return jsonify({
+                'success': True,
+                'task_id': task_id,
+                'offset': offset,
+                'limit': limit,
+                'count': len(index.image_ids),
+                'complete': True,
+                'data': index.page(offset, limit)
+            })
+    if job is None:
+        return task_not_found(task_id, '查询任务不存在')
+    
+    if offset < job.base_count:
+        # 增量追加执行中：已有的结果从追加前的任务索引读取
+        index = task_store.get(task_id)
+        if index is not None:
+            return jsonify({
+                'success': True,
+                'task_id': task_id,
+                'offset': offset,
+                'limit': limit,
+                'count': job.snapshot(limit=0, include_missing=False)['count'],
+                'complete': False,
+                'data': index.page(offset, min(limit, job.base_count - offset))
+            })
+    
+    snapshot = job.snapshot(offset=offset, limit=limit, include_missing=False)
+    return jsonify({
+        'success': snapshot['status'] != 'failed',
+        'task_id': task_id,
+        'offset': offset,
+        'limit': limit,
+        'count': snapshot['count'],
+        'complete': snapshot['status'] in ('done', 'failed'),
+        'data': snapshot['data'],
+        'error': snapshot['error']
+    })
+
+
+def image_etag(img_path, st):
+    """原图的强 ETag：路径、修改时间和大小任一变化时改变"""
+    return hashlib.sha1(f'{img_path}\0{st.st_mtime_ns}\0{st.st_size}'.encode('utf-8')).hexdigest()
+
+
 @app.route('/api/image/<path:filename>')
 def get_image(filename):
-    """获取图片（从原始路径）"""
+    """获取图片（从原始路径）
+
+    返回 ETag、Last-Modified 和长缓存时间（image_cache_max_age），If-None-Match / If-Modified-Since
+    命中时返回 304 且不读取原图；支持 Range 分段请求。
+    """
     try:
         # 从查询参数获取完整路径
         img_path = request.args.get('path', '')
         if not img_path:
             return jsonify({'error': '图片路径不能为空'}), 400
         
-        # 检查文件是否存在
-        if not os.path.exists(img_path):
+        # 检查文件是否存在（使用路径检查缓存，浏览同一目录的图片时不再逐个访问共享目录）
+        with g.stopwatch.time('stat'):
+            st = path_probe.stat(img_path)
+        if st is None:
+            return jsonify({'error': '图片文件不存在'}), 404
+        
+        etag = image_etag(img_path, st)
+        last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+        max_age = int(load_config().get('image_cache_max_age', DEFAULT_CONFIG['image_cache_max_age']))
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+        else:
+            # 返回图片文件（缓存期内被删除的图片按不存在处理），Range 和条件请求由 send_file 处理
+            try:
+                with g.stopwatch.time('open'):
+                    response = send_file(img_path, etag=etag, last_modified=last_modified, max_age=max_age,
+                                         conditional=True)
+            except FileNotFoundError:
+                path_probe.invalidate(img_path)
+                return jsonify({'error': '图片文件不存在'}), 404
+        # 同一路径的原图不会被修改（检测图片写入后不再变化），允许浏览器长期缓存
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        if max_age:
+            response.cache_control.immutable = True
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/thumbnail/<path:filename>')
+def get_thumbnail(filename):
+    """获取图片缩略图（size 指定最大边长，format 为 jpeg 或 webp），未安装 Pillow 时返回原图"""
+    try:
+        img_path = request.args.get('path', '')
+        if not img_path:
+            return jsonify({'error': '图片路径不能为空'}), 400
+        
+        with g.stopwatch.time('stat'):
+            exists = path_probe.exists(img_path)
+        if not exists:
+            return jsonify({'error': '图片文件不存在'}), 404
+        
+        if not thumbnail_cache.available:
+            return send_file(img_path)
+        
+        app_config = load_config()
+        size = request.args.get('size', app_config.get('thumbnail_size', DEFAULT_CONFIG['thumbnail_size']), type=int)
+        size = min(max(size, 32), 2048)
+        fmt = request.args.get('format', app_config.get('thumbnail_format', DEFAULT_CONFIG['thumbnail_format'])).lower()
+        if fmt not in THUMBNAIL_FORMATS:
+            return jsonify({'error': f'不支持的缩略图格式: {fmt}'}), 400
+        
+        try:
+            with g.stopwatch.time('thumbnail'):
+                thumb_path, mimetype = thumbnail_cache.get(img_path, size=size, fmt=fmt)
+        except FileNotFoundError:
             return jsonify({'error': '图片文件不存在'}), 404
+        except Exception as e:
+            # 无法解码的图片直接返回原图
+            print(f"⚠️ 生成缩略图失败: {e}")
+            return send_file(img_path)
         
-        # 返回图片文件
-        return send_file(img_path)
+        # 缓存键包含源文件修改时间，浏览器可以放心缓存
+        return send_file(thumb_path, mimetype=mimetype, max_age=3600)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -435,121 +1492,100 @@ def export_coco(task_id):
     try:
         task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
         coco_path = os.path.join(task_dir, '_annotations.coco.json')
-        csv_path = os.path.join(task_dir, 'result.csv')
         
         if not os.path.exists(coco_path):
-            return jsonify({'error': 'COCO 文件不存在'}), 404
+            return task_not_found(task_id, 'COCO 文件不存在')
+        export_janitor.touch(task_id)
         
-        # 获取选中的图片索引（如果提供了）
+        # 获取选中的图片索引或筛选条件（如果提供了），支持 JSON 请求体或表单字段
         selected_indices = None
+        raw_filters = None
         if request.method == 'POST':
-            data = request.get_json() or {}
+            data = request.get_json(silent=True) or {}
             selected_indices = data.get('selected_indices', None)
+            if selected_indices is None and request.form.get('selected_indices'):
+                selected_indices = json.loads(request.form['selected_indices'])
             if selected_indices is not None:
                 selected_indices = set(int(idx) for idx in selected_indices)
+            raw_filters = data.get('filters', None)
+            if raw_filters is None and request.form.get('filters'):
+                raw_filters = json.loads(request.form['filters'])
+        
+        with g.stopwatch.time('index'):
+            index = task_store.get(task_id)
+        if index is None:
+            return jsonify({'error': 'COCO 文件不存在'}), 404
         
-        # 读取原始CSV数据以获取图片文件名映射
-        image_filename_map = {}
-        if os.path.exists(csv_path):
+        # 按筛选条件导出：使用任务的筛选索引，不需要客户端传入图片 id 列表
+        if raw_filters:
             try:
-                df = pd.read_csv(csv_path, encoding='utf-8')
-                for idx, row in df.iterrows():
-                    img_path = row.get('img_path', '')
-                    if pd.notna(img_path) and img_path:
-                        img_name = os.path.basename(str(img_path))
-                        image_filename_map[int(idx)] = img_name
-            except Exception as e:
-                print(f"⚠️ 读取CSV文件警告: {e}")
+                filters = parse_filters(raw_filters, index.categories)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            with g.stopwatch.time('filter'):
+                matched = index.filter_index().select_ids(filters)
+            if not matched:
+                return jsonify({'error': '没有符合筛选条件的图片'}), 400
+            selected_indices = set(matched) if selected_indices is None else selected_indices & set(matched)
+            if not selected_indices:
+                return jsonify({'error': '没有符合筛选条件的图片'}), 400
         
-        # 读取COCO数据
-        with open(coco_path, 'r', encoding='utf-8') as f:
-            coco_data = json.load(f)
+        # 图片 id → 导出时读取的路径：lazy 模式直接读取原始图片，否则读取任务目录中的暂存文件
+        lazy = index.mode == 'lazy'
         
-        # 如果指定了选中的图片，过滤COCO数据
-        if selected_indices is not None and len(selected_indices) > 0:
-            # 过滤images
-            filtered_images = [img for img in coco_data['images'] if img.get('id') in selected_indices]
-            selected_image_ids = {img['id'] for img in filtered_images}
-            
-            # 过滤annotations（只保留选中图片的标注）
-            filtered_annotations = [ann for ann in coco_data['annotations'] if ann.get('image_id') in selected_image_ids]
-            
-            # 创建新的COCO数据
-            filtered_coco = {
-                'images': filtered_images,
-                'annotations': filtered_annotations,
-                'categories': coco_data.get('categories', [])
-            }
-            
-            # 临时保存过滤后的COCO文件
-            filtered_coco_path = os.path.join(task_dir, '_annotations_filtered.coco.json')
-            with open(filtered_coco_path, 'w', encoding='utf-8') as f:
-                json.dump(filtered_coco, f, ensure_ascii=False, indent=4)
-            coco_path = filtered_coco_path
+        def image_source(image_id):
+            return index.img_paths[image_id] if lazy else os.path.join(task_dir, index.filename(image_id))
         
-        # 创建临时ZIP文件
-        zip_filename = f'coco_export_{task_id}.zip'
-        zip_path = os.path.join(app.config['UPLOAD_FOLDER'], zip_filename)
+        # COCO JSON：未选择图片时直接打包原文件，否则按行读取原文件，逐条写出所选图片的数据
+        # （旧版缩进格式的文件从任务索引中读取）
+        coco_source = coco_path
+        if selected_indices is not None and len(selected_indices) > 0:
+            if is_compact(coco_path):
+                coco_source = iter_coco_json(*iter_selected_records(coco_path, selected_indices))
+            else:
+                coco_source = iter_coco_json(*index.filtered_records(selected_indices))
         
-        try:
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # 添加COCO JSON文件
-                zipf.write(coco_path, '_annotations.coco.json')
-                
-                # 添加图片文件
-                image_count = 0
-                if selected_indices is not None and len(selected_indices) > 0:
-                    # 只添加选中的图片
-                    for idx in selected_indices:
-                        img_name = image_filename_map.get(idx)
-                        if img_name:
-                            file_path = os.path.join(task_dir, img_name)
-                            if os.path.exists(file_path) and os.path.isfile(file_path):
-                                zipf.write(file_path, img_name)
-                                image_count += 1
-                else:
-                    # 添加所有图片文件
-                    for filename in os.listdir(task_dir):
-                        file_path = os.path.join(task_dir, filename)
-                        # 只添加图片文件，跳过JSON和CSV文件
-                        if os.path.isfile(file_path) and filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')):
-                            zipf.write(file_path, filename)
-                            image_count += 1
-            
-            # 清理临时过滤的COCO文件
-            if selected_indices is not None and os.path.exists(filtered_coco_path):
-                try:
-                    os.remove(filtered_coco_path)
-                except:
-                    pass
-            
-            # 返回ZIP文件
-            response = send_file(zip_path, as_attachment=True, download_name=f'coco_export_{task_id}.zip', mimetype='application/zip')
-            
-            # 延迟删除临时ZIP文件（在响应发送后）
-            def remove_file():
-                try:
-                    if os.path.exists(zip_path):
-                        os.remove(zip_path)
-                except:
-                    pass
+        def iter_entries():
+            # 添加COCO JSON文件
+            yield '_annotations.coco.json', coco_source
             
-            # 使用Flask的after_request机制会在响应后清理，但这里我们使用线程延迟删除
-            import threading
-            timer = threading.Timer(60.0, remove_file)  # 60秒后删除
-            timer.start()
-            
-            return response
-        except Exception as zip_error:
-            # 如果ZIP创建失败，尝试删除临时文件
+            # 添加图片文件（读取到哪张就发送哪张）
+            if selected_indices is not None and len(selected_indices) > 0:
+                # 只添加选中的图片
+                for idx in sorted(selected_indices):
+                    img_name = index.filename(idx)
+                    if img_name:
+                        file_path = image_source(idx)
+                        if os.path.isfile(file_path):
+                            yield img_name, file_path
+            elif lazy:
+                # 添加清单中的所有图片（同名图片只保留最后一张，与暂存时一致）
+                lazy_sources = {index.filename(idx): path for idx, path in index.img_paths.items()}
+                for img_name, file_path in lazy_sources.items():
+                    if os.path.isfile(file_path):
+                        yield img_name, file_path
+            else:
+                # 添加所有图片文件
+                for filename in os.listdir(task_dir):
+                    file_path = os.path.join(task_dir, filename)
+                    # 只添加图片文件，跳过JSON和CSV文件
+                    if os.path.isfile(file_path) and filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')):
+                        yield filename, file_path
+        
+        def generate():
             try:
-                if os.path.exists(zip_path):
-                    os.remove(zip_path)
-                if selected_indices is not None and os.path.exists(filtered_coco_path):
-                    os.remove(filtered_coco_path)
-            except:
-                pass
-            raise zip_error
+                yield from iter_zip(iter_entries())
+            except Exception as e:
+                # 响应头已经发出，只能中断传输并记录错误
+                print(f"❌ 导出 ZIP 失败: {e}")
+                raise
+        
+        # 边打包边发送，不生成临时 ZIP 文件
+        return Response(
+            stream_with_context(metered_stream(generate(), 'zip')),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename=coco_export_{task_id}.zip'}
+        )
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -557,15 +1593,24 @@ def export_coco(task_id):
 
 @app.route('/api/export-csv/<task_id>')
 def export_csv(task_id):
-    """导出 CSV 文件"""
+    """导出 CSV 文件（Arrow 格式的任务边转换边发送）"""
     try:
         task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
         csv_path = os.path.join(task_dir, 'result.csv')
         
-        if not os.path.exists(csv_path):
-            return jsonify({'error': 'CSV 文件不存在'}), 404
+        if not has_table(task_dir):
+            return task_not_found(task_id, 'CSV 文件不存在')
+        export_janitor.touch(task_id)
         
-        return send_file(csv_path, as_attachment=True, download_name='result.csv')
+        if not arrow_parts(task_dir):
+            EXPORT_BYTES.inc(os.path.getsize(csv_path), format='csv')
+            return send_file(csv_path, as_attachment=True, download_name='result.csv')
+        
+        return Response(
+            stream_with_context(metered_stream(iter_task_csv(task_dir), 'csv')),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=result.csv'}
+        )
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -575,20 +1620,79 @@ def export_csv(task_id):
 def get_coco_data(task_id):
     """获取 COCO 格式数据"""
     try:
-        task_dir = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
-        coco_path = os.path.join(task_dir, '_annotations.coco.json')
-        
-        if not os.path.exists(coco_path):
-            return jsonify({'error': 'COCO 文件不存在'}), 404
+        index = task_store.get(task_id)
+        if index is None:
+            return task_not_found(task_id, 'COCO 文件不存在')
+        export_janitor.touch(task_id)
         
-        with open(coco_path, 'r', encoding='utf-8') as f:
-            coco_data = json.load(f)
-        
-        return jsonify({'success': True, 'data': coco_data})
+        return jsonify({'success': True, 'data': index.coco})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/coco/<task_id>/query', methods=['GET', 'POST'])
+def query_coco_data(task_id):
+    """按类别、置信度、defect_type 和图片状态筛选任务的 COCO 数据，分页返回图片及标注
+
+    筛选条件见 coco_query.parse_filters，GET 时为查询参数（列表用逗号分隔），POST 时为请求体的 filters。
+    同时返回各类别满足条件的标注数和图片数。
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        raw_filters = data.get('filters') or {}
+        offset = data.get('offset', 0)
+        limit = data.get('limit', 200)
+    else:
+        raw_filters = {key: request.args.get(key) for key in FILTER_KEYS if key in request.args}
+        offset = request.args.get('offset', 0)
+        limit = request.args.get('limit', 200)
+    try:
+        offset = max(int(offset), 0)
+        limit = min(max(int(limit), 0), 1000)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'offset 和 limit 必须是整数'}), 400
+    
+    with g.stopwatch.time('index'):
+        index = task_store.get(task_id)
+    if index is None:
+        return task_not_found(task_id, 'COCO 文件不存在')
+    export_janitor.touch(task_id)
+    
+    try:
+        filters = parse_filters(raw_filters, index.categories)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    with g.stopwatch.time('filter'):
+        filter_index = index.filter_index()
+        positions, ann_mask = filter_index.query(filters)
+        category_counts = filter_index.category_counts(ann_mask)
+    with g.stopwatch.time('page'):
+        data = [index.result_item(filter_index.image_ids[i]) for i in positions[offset:offset + limit]]
+    
+    return jsonify({
+        'success': True,
+        'task_id': task_id,
+        'filters': filters,
+        'offset': offset,
+        'limit': limit,
+        'count': int(len(positions)),
+        'annotation_count': int(ann_mask.sum()),
+        'category_counts': category_counts,
+        'data': data
+    })
+
+
+def create_app():
+    """应用入口：启动当前进程的后台线程并返回 Flask 应用
+
+    多进程部署时每个 worker 进程调用一次（见 wsgi.py），不要使用 gunicorn 的 --preload，
+    否则后台线程和线程池会在 fork 之前创建。
+    """
+    export_janitor.start()
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5050)
+    create_app().run(debug=True, host='0.0.0.0', port=5050)
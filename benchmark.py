@@ -0,0 +1,425 @@
+"""
+性能基准：不依赖生产数据库和图片共享目录，测量查询、生成 COCO 和导出各阶段的耗时、峰值内存和写入量
+
+用法:
+    python benchmark.py --rows 1000 100000 1000000 --workdir /tmp/pc-bench --json result.json
+    python benchmark.py --rows 100000 --compare result.json   # 与上次结果比较，耗时变慢超过阈值时返回非 0
+
+每个数据规模会生成:
+    - SQLite 数据库，表结构与 product_detection_detail_result 一致（含 infer_raw_result JSON）
+    - img_base_path 下的合成图片目录（按日期分目录，--missing-ratio 控制缺失图片比例）
+应用通过 Flask test client 调用，数据库客户端替换为 SQLiteClient（与 MySQLClient 接口一致）。
+工作目录中会生成 config.json、exports/ 等文件，未指定 --workdir 时使用临时目录。
+峰值内存为本进程的 RSS（coco_parse_workers 启用的子进程不计入）。
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+try:
+    from PIL import Image, ImageFilter
+except ImportError:  # 未安装 Pillow 时写入最小的 JPEG 字节
+    Image = None
+
+TABLE = 'product_detection_detail_result'
+BENCH_SQL = f"SELECT * FROM {TABLE} WHERE c_time BETWEEN '${{START_TIME}}' AND '${{END_TIME}}' ORDER BY c_time, id"
+START_TIME = datetime(2025, 1, 1)
+ROW_INTERVAL = timedelta(seconds=3)
+DEFECT_NAMES = ['划伤', '压痕', '异物外漏', '折痕', '水渍', '破损', '碰伤', '线头', '脏污', '褶皱(T型)']
+IMAGE_VARIANTS = 16
+
+
+class SQLiteClient:
+    """SQLite 数据库客户端，接口与 app.MySQLClient 一致，用于基准测试和本地调试
+
+    每次查询使用独立连接，可在查询线程和分片线程中并发使用。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pool = None
+
+    def _connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def query(self, sql):
+        conn = self._connect()
+        try:
+            return pd.read_sql(sql, conn)
+        finally:
+            conn.close()
+
+    def query_chunks(self, sql, chunk_size=5000):
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql)
+            columns = [desc[0] for desc in cursor.description]
+            offset = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+                df.index = pd.RangeIndex(offset, offset + len(df))
+                offset += len(df)
+                yield df
+        finally:
+            conn.close()
+
+    def stats(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def _infer_raw_result(rng, width, height):
+    """与推理服务输出结构相近的 infer_raw_result（0~4 个预测框，附带不参与转换的字段）"""
+    predictions = []
+    for _ in range(rng.choice((0, 0, 1, 1, 1, 2, 2, 3, 4))):
+        w = rng.randint(8, width // 4)
+        h = rng.randint(8, height // 4)
+        predictions.append({
+            'name': rng.choice(DEFECT_NAMES),
+            'confidence': round(rng.uniform(0.3, 1.0), 4),
+            'defect_type': rng.randint(0, 17),
+            'points': [{'x': rng.randint(0, width - w), 'y': rng.randint(0, height - h), 'w': w, 'h': h}],
+            'class_id': rng.randint(0, 17),
+            'mask': None
+        })
+    return json.dumps({
+        'predictions': predictions,
+        'model_version': 'bench-1.0',
+        'image_size': {'width': width, 'height': height},
+        'elapsed_ms': round(rng.uniform(5, 40), 2)
+    }, ensure_ascii=False)
+
+
+def _image_bytes(width, height):
+    """生成若干张内容不同的 JPEG（渐变 + 轻微噪声，大小与压缩后的产线图片比例相近），写图片时循环使用"""
+    if Image is None:
+        return [b'\xff\xd8\xff\xe0' + bytes([i]) * 512 + b'\xff\xd9' for i in range(IMAGE_VARIANTS)]
+    variants = []
+    for i in range(IMAGE_VARIANTS):
+        gradient = Image.linear_gradient('L').resize((width, height)).rotate(i * 360 / IMAGE_VARIANTS)
+        noise = Image.effect_noise((width, height), 24).filter(ImageFilter.GaussianBlur(2))
+        image = Image.merge('RGB', (gradient, noise, Image.new('L', (width, height), i * 16)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        variants.append(buffer.getvalue())
+    return variants
+
+
+def generate_dataset(db_path, img_dir, rows, seed=0, batch_size=50000, missing_ratio=0.0,
+                     image_size=(320, 240), write_images=True):
+    """生成 rows 行合成数据和对应的图片目录，返回查询使用的时间范围 (start_time, end_time)"""
+    rng = random.Random(seed)
+    width, height = image_size
+    variants = _image_bytes(width, height) if write_images else None
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"""
+        CREATE TABLE {TABLE} (
+            id INTEGER PRIMARY KEY,
+            c_time TEXT,
+            product_id INTEGER,
+            code TEXT,
+            position TEXT,
+            origin_object_key TEXT,
+            local_pic_url TEXT,
+            check_status INTEGER,
+            detection_result_status INTEGER,
+            manual_check_status INTEGER,
+            ext TEXT,
+            infer_raw_result TEXT
+        )
+    """)
+    conn.execute(f'CREATE INDEX idx_c_time ON {TABLE} (c_time)')
+    created_dirs = set()
+    for start in range(0, rows, batch_size):
+        records = []
+        for i in range(start, min(start + batch_size, rows)):
+            c_time = START_TIME + ROW_INTERVAL * i
+            key = f"{c_time:%Y/%m/%d}/{i % 1000:03d}/img_{i:08d}.jpg"
+            raw = _infer_raw_result(rng, width, height)
+            names = sorted({p['name'] for p in json.loads(raw)['predictions']})
+            records.append((
+                i + 1, c_time.strftime('%Y-%m-%d %H:%M:%S'), 100000 + i // 8, f'SN{i:09d}', f'P{i % 8}',
+                key, os.path.join(img_dir, key), int(bool(names)), 1, rng.choice((None, 0, 1)),
+                json.dumps({'defects': names}, ensure_ascii=False), raw
+            ))
+            if write_images and rng.random() >= missing_ratio:
+                path = os.path.join(img_dir, key)
+                directory = os.path.dirname(path)
+                if directory not in created_dirs:
+                    os.makedirs(directory, exist_ok=True)
+                    created_dirs.add(directory)
+                with open(path, 'wb') as f:
+                    f.write(variants[i % len(variants)])
+        conn.executemany(f'INSERT INTO {TABLE} VALUES ({",".join("?" * 12)})', records)
+        conn.commit()
+    conn.close()
+    end_time = START_TIME + ROW_INTERVAL * max(rows - 1, 0)
+    return START_TIME.strftime('%Y-%m-%d %H:%M:%S'), end_time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _current_rss():
+    """当前进程 RSS（字节），无法读取时返回 None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _written_bytes():
+    """本进程累计写入的字节数（/proc/self/io 的 wchar），不支持时返回 None"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _dir_bytes(path):
+    nbytes = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                nbytes += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return nbytes
+
+
+class StageMeter:
+    """测量一个阶段的耗时、峰值 RSS 和写入字节数
+
+    峰值 RSS 由后台线程每 interval 秒采样（读取 /proc/self/statm），
+    不支持时退回 getrusage 的进程历史峰值。写入量优先使用 /proc/self/io，否则使用工作目录大小的变化。
+    """
+
+    def __init__(self, workdir, interval=0.01):
+        self.workdir = workdir
+        self.interval = interval
+        self.output_bytes = 0  # 响应体等不落盘的输出，由调用方累加
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = _current_rss()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss, rss)
+
+    def __enter__(self):
+        self.peak_rss = _current_rss() or 0
+        self._written = _written_bytes()
+        self._dir_bytes = _dir_bytes(self.workdir) if self._written is None else None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        self._stop.set()
+        self._thread.join()
+        rss = _current_rss()
+        if rss is None and resource is not None:
+            # ru_maxrss 在 Linux 上以 KB 为单位
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.peak_rss = max(self.peak_rss, rss or 0)
+        if self._written is not None:
+            self.bytes_written = _written_bytes() - self._written
+        else:
+            self.bytes_written = _dir_bytes(self.workdir) - self._dir_bytes
+        return False
+
+
+def _run_query(client, body, poll_interval=0.02):
+    response = client.post('/api/query', json=body)
+    result = response.get_json()
+    if not result.get('success'):
+        raise RuntimeError(f"提交查询失败: {result.get('error')}")
+    task_id = result['task_id']
+    while True:
+        job = client.get(f'/api/query/{task_id}?limit=0').get_json()
+        if job['status'] == 'done':
+            return task_id, job
+        if job['status'] == 'failed':
+            raise RuntimeError(f"查询失败: {job.get('error')}")
+        time.sleep(poll_interval)
+
+
+def _consume(response):
+    """读完流式响应，返回字节数"""
+    nbytes = 0
+    for chunk in response.response:
+        nbytes += len(chunk)
+    response.close()
+    return nbytes
+
+
+def run_benchmark(app_module, workdir, rows, args):
+    """对一个数据规模执行全部阶段，返回各阶段的测量结果"""
+    results = []
+    client = app_module.app.test_client()
+
+    def record(stage, meter, **extra):
+        item = {
+            'rows': rows,
+            'stage': stage,
+            'seconds': round(meter.seconds, 3),
+            'peak_rss': meter.peak_rss,
+            'bytes_written': meter.bytes_written,
+            'output_bytes': meter.output_bytes
+        }
+        item.update(extra)
+        results.append(item)
+        print(f"  {stage:<16} {item['seconds']:>9.3f}s  RSS {item['peak_rss'] / 1024 / 1024:>8.1f} MB  "
+              f"写入 {item['bytes_written'] / 1024 / 1024:>9.1f} MB  输出 {item['output_bytes'] / 1024 / 1024:>9.1f} MB")
+
+    db_path = os.path.join(workdir, f'bench_{rows}.sqlite')
+    img_dir = os.path.join(workdir, f'images_{rows}')
+    with StageMeter(workdir) as meter:
+        start_time, end_time = generate_dataset(
+            db_path, img_dir, rows, seed=args.seed, missing_ratio=args.missing_ratio,
+            image_size=args.image_size, write_images=not args.no_images
+        )
+    record('generate', meter)
+
+    app_module.db_client = SQLiteClient(db_path)
+    with open('config.json', 'r', encoding='utf-8') as f:
+        config = dict(json.load(f), img_base_path=img_dir + '/')
+    with open('config.json', 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+
+    body = {'sql': BENCH_SQL, 'start_time': start_time, 'end_time': end_time, 'no_cache': True}
+    if args.shards > 1:
+        body['shards'] = args.shards
+    task_ids = {}
+    for mode in ('copy', 'lazy'):
+        if mode == 'copy' and args.no_images:
+            continue
+        with StageMeter(workdir) as meter:
+            task_ids[mode], job = _run_query(client, dict(body, export_mode=mode))
+        record(f'query_{mode}', meter, task_id=task_ids[mode], progress=job.get('progress'))
+
+    task_id = task_ids.get('copy') or task_ids['lazy']
+    with StageMeter(workdir) as meter:
+        meter.output_bytes = _consume(client.get(f'/api/export/{task_id}'))
+    record('export_coco', meter, task_id=task_id)
+
+    selected = list(range(0, rows, 10))
+    with StageMeter(workdir) as meter:
+        meter.output_bytes = _consume(client.post(f'/api/export/{task_id}', json={'selected_indices': selected}))
+    record('export_selected', meter, task_id=task_id, selected=len(selected))
+
+    csv_path = os.path.join(workdir, f'bench_{rows}.csv')
+    with StageMeter(workdir) as meter:
+        response = client.get(f'/api/export-csv/{task_id}')
+        with open(csv_path, 'wb') as f:
+            for chunk in response.response:
+                f.write(chunk)
+                meter.output_bytes += len(chunk)
+        response.close()
+    record('export_csv', meter, task_id=task_id)
+
+    from csv2coco import csv2coco
+    with StageMeter(workdir) as meter:
+        csv2coco(csv_path, os.path.join(workdir, f'bench_{rows}.coco.json'), chunksize=args.chunk_size)
+    record('csv2coco', meter)
+    return results
+
+
+def compare_results(results, baseline_path, tolerance):
+    """与基准结果比较耗时，返回变慢超过 tolerance（比例）的阶段"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(item['rows'], item['stage']): item for item in json.load(f)['results']}
+    regressions = []
+    for item in results:
+        base = baseline.get((item['rows'], item['stage']))
+        if base is None or item['stage'] == 'generate':
+            continue
+        # 很短的阶段受噪声影响大，至少慢 0.05 秒才算退化
+        if item['seconds'] > base['seconds'] * (1 + tolerance) and item['seconds'] - base['seconds'] > 0.05:
+            regressions.append((item, base))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='picture-collection 性能基准')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000], help='数据规模，例如 1000 100000 1000000')
+    parser.add_argument('--workdir', default=None, help='工作目录（默认使用临时目录）')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='query_chunk_size')
+    parser.add_argument('--shards', type=int, default=1, help='时间分片数')
+    parser.add_argument('--image-size', type=lambda s: tuple(int(v) for v in s.split('x')), default=(320, 240),
+                        help='合成图片尺寸，例如 320x240')
+    parser.add_argument('--missing-ratio', type=float, default=0.0, help='缺失图片的比例')
+    parser.add_argument('--no-images', action='store_true', help='不生成图片，只测试清单模式')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='把结果保存为 JSON')
+    parser.add_argument('--compare', default=None, help='与之前保存的 JSON 结果比较')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的耗时增加比例')
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='picture-collection-bench-'))
+    json_path = os.path.abspath(args.json) if args.json else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    os.makedirs(workdir, exist_ok=True)
+    # app 在导入时按当前目录创建 exports/ 并读取 config.json，因此先切换到工作目录
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    with open('config.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'img_path_mode': 'concat',
+            'img_path_field': 'origin_object_key',
+            'query_chunk_size': args.chunk_size,
+            'result_cache_ttl': 0,
+            'janitor_interval': 0,
+            'export_max_age': 0
+        }, f, ensure_ascii=False, indent=4)
+    import app as app_module
+
+    print(f"工作目录: {workdir}")
+    results = []
+    for rows in args.rows:
+        print(f"▶ {rows} 行")
+        results.extend(run_benchmark(app_module, workdir, rows, args))
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': datetime.now().isoformat(timespec='seconds'), 'results': results},
+                      f, ensure_ascii=False, indent=2)
+
+    if compare_path:
+        regressions = compare_results(results, compare_path, args.tolerance)
+        for item, base in regressions:
+            print(f"❌ {item['rows']} 行 {item['stage']}: {base['seconds']:.3f}s → {item['seconds']:.3f}s")
+        if regressions:
+            return 1
+        print("✅ 没有发现性能退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import os
+import shutil
+import hashlib
+import threading
+
+from staging import _reflink
+
+
+class BlobStore:
+    """按源图片路径 + 修改时间 + 大小寻址的图片仓库，多个任务共享同一份图片
+
+    任务目录中的图片是仓库文件的硬链接，引用计数即 inode 的链接数：
+    仓库文件自身占 1 个链接，链接数为 1 表示已没有任务引用，可由 gc() 删除。
+    仓库必须与任务目录位于同一文件系统（默认在 exports/_blobs 下）。
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob_path(self, src, src_stat):
+        raw = f'{os.path.abspath(src)}|{src_stat.st_mtime_ns}|{src_stat.st_size}'
+        key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        ext = os.path.splitext(src)[1].lower()
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def put(self, src, src_stat=None, reflink=True):
+        """确保源图片已在仓库中，返回 (仓库路径, 是否新写入)
+
+        已存在时只需一次 stat；不存在时尝试 reflink，失败则复制。
+        """
+        src_stat = src_stat or os.stat(src)
+        path = self.blob_path(src, src_stat)
+        if os.path.exists(path):
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            try:
+                if not reflink:
+                    raise OSError('reflink 未启用')
+                _reflink(src, tmp_path)
+            except OSError:
+                shutil.copy2(src, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        return path, True
+
+    def link(self, src, dest, src_stat=None, reflink=True):
+        """把源图片放入仓库并硬链接到 dest，返回是否新写入了仓库文件"""
+        tmp_dest = f'{dest}.{threading.get_ident()}.tmp'
+        try:
+            for attempt in range(2):
+                path, created = self.put(src, src_stat, reflink)
+                try:
+                    os.link(path, tmp_dest)
+                    break
+                except FileNotFoundError:
+                    # 仓库文件恰好被 gc 删除，重新写入一次
+                    if attempt:
+                        raise
+            os.replace(tmp_dest, dest)
+            return created
+        finally:
+            if os.path.exists(tmp_dest):
+                try:
+                    os.remove(tmp_dest)
+                except OSError:
+                    pass
+
+    def _iter_blobs(self):
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith('.tmp'):
+                    yield os.path.join(root, name)
+
+    def inodes(self):
+        """仓库文件的 (st_dev, st_ino) → (大小, 引用数)"""
+        inodes = {}
+        for path in self._iter_blobs():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            inodes[(st.st_dev, st.st_ino)] = (st.st_size, st.st_nlink - 1)
+        return inodes
+
+    def gc(self):
+        """删除没有任务引用（链接数为 1）的仓库文件，返回 (删除数量, 释放字节数)"""
+        removed = 0
+        freed = 0
+        for path in self._iter_blobs():
+            try:
+                st = os.stat(path)
+                if st.st_nlink <= 1:
+                    os.remove(path)
+                    removed += 1
+                    freed += st.st_size
+            except OSError:
+                continue
+        return removed, freed
+
+    def stats(self):
+        """仓库文件数、总大小和引用数（遍历仓库目录，耗时与文件数成正比）"""
+        blobs = 0
+        nbytes = 0
+        refs = 0
+        for path in self._iter_blobs():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            blobs += 1
+            nbytes += st.st_size
+            refs += st.st_nlink - 1
+        return {'blobs': blobs, 'bytes': nbytes, 'references': refs}
@@ -0,0 +1,219 @@
+import numpy as np
+
+# 按图片元数据筛选的字段（与 app.RESULT_META_FIELDS 中的状态字段一致）
+STATUS_FIELDS = ('check_status', 'detection_result_status', 'manual_check_status')
+# 筛选条件中可以使用的键
+FILTER_KEYS = ('categories', 'min_score', 'max_score', 'defect_types', 'has_annotations') + STATUS_FIELDS
+
+
+def normalize_status(value):
+    """状态取值统一为字符串：可为空的整数列读出的浮点数去掉小数部分（1.0 → '1'），空值（None、NaN）为空字符串"""
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        if isinstance(value, (bool, np.bool_)):
+            return str(value)
+        if not isinstance(value, (int, float, np.integer, np.floating)):
+            return normalize_status(str(value))
+        number = float(value)
+    else:
+        value = value.strip()
+        if value.lower() in ('nan', 'none', 'nat', '<na>'):
+            return ''
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+    if np.isnan(number):
+        return ''
+    if number.is_integer():
+        return str(int(number))
+    return str(number)
+
+
+def _as_list(value):
+    if isinstance(value, str):
+        return [part for part in value.split(',') if part != '']
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def parse_filters(data, categories):
+    """校验筛选条件（JSON 对象或查询参数），类别名称转换为类别 id，条件不合法时抛出 ValueError
+
+    - categories: 类别名称或 id 列表，图片至少有一个该类别的标注
+    - min_score / max_score: 标注置信度范围（闭区间）
+    - defect_types: 标注的 defect_type 列表
+    - check_status / detection_result_status / manual_check_status: 图片状态取值列表
+    - has_annotations: true 只保留有标注的图片，false 只保留没有标注的图片
+    同一条标注需要同时满足类别、置信度和 defect_type 条件；各条件之间为“且”。
+    """
+    name2id = {category['name']: category['id'] for category in categories}
+    valid_ids = set(name2id.values())
+    filters = {}
+    for key in FILTER_KEYS:
+        value = data.get(key)
+        if value is None or value == '' or value == []:
+            continue
+        if key == 'categories':
+            category_ids = set()
+            for item in _as_list(value):
+                if item in name2id:
+                    category_ids.add(name2id[item])
+                    continue
+                try:
+                    category_id = int(item)
+                except (TypeError, ValueError):
+                    raise ValueError(f'未知的类别: {item}')
+                if category_id not in valid_ids:
+                    raise ValueError(f'未知的类别: {item}')
+                category_ids.add(category_id)
+            filters[key] = sorted(category_ids)
+        elif key in ('min_score', 'max_score'):
+            try:
+                filters[key] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} 必须是数字: {value}')
+        elif key == 'has_annotations':
+            filters[key] = _as_bool(value)
+        else:
+            filters[key] = [normalize_status(item) for item in _as_list(value)]
+    return filters
+
+
+class CocoFilterIndex:
+    """任务 COCO 数据的筛选索引
+
+    标注按列保存为 numpy 数组（所属图片位置、类别、置信度），并预建：
+    - 类别 → 标注位置数组、defect_type → 标注位置数组
+    - 按置信度排序的数组，阈值查询用二分查找得到标注范围
+    - 图片状态字段 → 取值 → 图片位置数组
+    查询只在这些数组上做布尔运算，按类别计数时不生成任何记录。图片位置为任务结果中的顺序。
+    """
+
+    def __init__(self, index):
+        self.image_ids = list(index.image_ids)
+        ann_image, ann_category, ann_score, ann_defect = [], [], [], []
+        for i, image_id in enumerate(self.image_ids):
+            for ann in index.annotations(image_id):
+                ann_image.append(i)
+                ann_category.append(ann.get('category_id', 0))
+                score = ann.get('score')
+                ann_score.append(np.nan if score is None else score)
+                ann_defect.append('' if ann.get('defect_type') is None else str(ann.get('defect_type')))
+        self.ann_image = np.asarray(ann_image, dtype=np.int64)
+        self.ann_category = np.asarray(ann_category, dtype=np.int64)
+        ann_score = np.asarray(ann_score, dtype=np.float64)
+        # 置信度升序排列（NaN 排在最后，不会落入任何阈值范围）
+        self.score_order = np.argsort(ann_score, kind='stable')
+        self.sorted_scores = ann_score[self.score_order]
+        self.category_positions = self._group(self.ann_category)
+        self.defect_positions = self._group(np.asarray(ann_defect, dtype=object))
+        self.status_positions = {}
+        for field in STATUS_FIELDS:
+            values = np.asarray([normalize_status(index.meta.get(image_id, {}).get(field))
+                                 for image_id in self.image_ids], dtype=object)
+            self.status_positions[field] = self._group(values)
+        self.categories = index.categories
+        self.has_annotations = np.bincount(self.ann_image, minlength=len(self.image_ids)) > 0
+        self.nbytes = sum(array.nbytes for array in (self.ann_image, self.ann_category, self.score_order,
+                                                     self.sorted_scores)) * 2
+
+    @staticmethod
+    def _group(values):
+        """取值 → 位置数组"""
+        if len(values) == 0:
+            return {}
+        order = np.argsort(values, kind='stable')
+        sorted_values = values[order]
+        boundaries = np.flatnonzero(sorted_values[1:] != sorted_values[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(values)]))
+        groups = {}
+        for start, end in zip(starts, ends):
+            key = sorted_values[start]
+            groups[key.item() if isinstance(key, np.generic) else key] = np.sort(order[start:end])
+        return groups
+
+    def _positions_mask(self, groups, keys, size):
+        mask = np.zeros(size, dtype=bool)
+        for key in keys:
+            positions = groups.get(key)
+            if positions is not None:
+                mask[positions] = True
+        return mask
+
+    def annotation_mask(self, filters):
+        """满足标注条件的标注掩码，没有标注条件时返回 None"""
+        n = len(self.ann_image)
+        mask = None
+        if 'categories' in filters:
+            mask = self._positions_mask(self.category_positions, filters['categories'], n)
+        if 'min_score' in filters or 'max_score' in filters:
+            lo = 0
+            hi = len(self.sorted_scores) - int(np.isnan(self.sorted_scores).sum())
+            if 'min_score' in filters:
+                lo = int(np.searchsorted(self.sorted_scores[:hi], filters['min_score'], side='left'))
+            if 'max_score' in filters:
+                hi = int(np.searchsorted(self.sorted_scores[:hi], filters['max_score'], side='right'))
+            score_mask = np.zeros(n, dtype=bool)
+            score_mask[self.score_order[lo:max(lo, hi)]] = True
+            mask = score_mask if mask is None else mask & score_mask
+        if 'defect_types' in filters:
+            defect_mask = self._positions_mask(self.defect_positions, filters['defect_types'], n)
+            mask = defect_mask if mask is None else mask & defect_mask
+        return mask
+
+    def image_mask(self, filters):
+        """满足图片状态条件的图片掩码"""
+        mask = np.ones(len(self.image_ids), dtype=bool)
+        for field in STATUS_FIELDS:
+            if field in filters:
+                mask &= self._positions_mask(self.status_positions[field], filters[field], len(self.image_ids))
+        if 'has_annotations' in filters:
+            mask &= self.has_annotations if filters['has_annotations'] else ~self.has_annotations
+        return mask
+
+    def query(self, filters):
+        """返回 (满足条件的图片位置数组（按结果顺序）, 这些图片中满足标注条件的标注掩码)"""
+        image_mask = self.image_mask(filters)
+        ann_mask = self.annotation_mask(filters)
+        if ann_mask is not None:
+            # 图片至少有一条满足标注条件的标注
+            with_match = np.zeros(len(self.image_ids), dtype=bool)
+            with_match[self.ann_image[ann_mask]] = True
+            image_mask &= with_match
+        else:
+            ann_mask = np.ones(len(self.ann_image), dtype=bool)
+        ann_mask = ann_mask & image_mask[self.ann_image]
+        return np.flatnonzero(image_mask), ann_mask
+
+    def category_counts(self, ann_mask):
+        """各类别满足条件的标注数和图片数"""
+        categories = self.ann_category[ann_mask]
+        annotations = np.bincount(categories) if len(categories) else np.zeros(0, dtype=np.int64)
+        # 同一图片同一类别只计一次
+        pairs = np.unique(categories * len(self.image_ids) + self.ann_image[ann_mask]) if len(categories) else categories
+        images = np.bincount(pairs // max(len(self.image_ids), 1)) if len(pairs) else np.zeros(0, dtype=np.int64)
+        counts = []
+        for category in self.categories:
+            category_id = category['id']
+            counts.append({
+                'id': category_id,
+                'name': category['name'],
+                'annotations': int(annotations[category_id]) if 0 <= category_id < len(annotations) else 0,
+                'images': int(images[category_id]) if 0 <= category_id < len(images) else 0
+            })
+        return counts
+
+    def select_ids(self, filters):
+        """满足条件的图片 id 列表（按结果顺序）"""
+        positions, _ = self.query(filters)
+        return [self.image_ids[i] for i in positions]
@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import itertools
+
+# 紧凑格式：每条记录一行，第二条起以逗号开头，便于边生成边写出，也便于按行读取
+#   {"images":[
+#   {...}
+#   ,{...}
+#   ],"categories":[
+#   ...
+#   ],"annotations":[
+#   ...
+#   ]}
+SECTIONS = ('images', 'categories', 'annotations')
+
+
+def dumps_record(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def _section_header(i, section):
+    return ('{' if i == 0 else '],') + f'"{section}":[\n'
+
+
+def _record_lines(records):
+    for n, record in enumerate(records):
+        yield (',' if n else '') + dumps_record(record) + '\n'
+
+
+def iter_coco_json(images, categories, annotations, batch_size=64 * 1024):
+    """按 images、categories、annotations 的顺序逐条生成紧凑的 COCO JSON（bytes）
+
+    三个参数都可以是生成器，内存占用只与单条记录和 batch_size 有关。
+    """
+    buffer = []
+    size = 0
+    for i, (section, records) in enumerate(zip(SECTIONS, (images, categories, annotations))):
+        for line in itertools.chain([_section_header(i, section)], _record_lines(records)):
+            buffer.append(line)
+            size += len(line)
+            if size >= batch_size:
+                yield ''.join(buffer).encode('utf-8')
+                buffer.clear()
+                size = 0
+    buffer.append(']}\n')
+    yield ''.join(buffer).encode('utf-8')
+
+
+def is_compact(path):
+    """文件是否为 CocoWriter 写出的紧凑格式（旧版缩进格式的文件只能整体解析）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.readline().strip() == _section_header(0, SECTIONS[0]).strip()
+
+
+def iter_coco_records(path, sections=None):
+    """按行读取 CocoWriter 写出的文件，逐条返回 (section, record)，不会把整个文件载入内存
+
+    指定 sections 时只解析这些部分的记录。
+    """
+    section = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.endswith(':['):
+                section = line.rsplit('"', 2)[-2]
+            elif line.startswith(('{', ',{')) and (sections is None or section in sections):
+                yield section, json.loads(line.lstrip(','))
+
+
+def iter_selected_records(path, image_ids):
+    """从紧凑格式的 COCO 文件中读取指定图片及其标注，返回 (images, categories, annotations) 生成器
+
+    每个部分各按行扫描一遍文件，内存中只保留 image_ids 和当前记录。
+    """
+    image_ids = set(image_ids)
+
+    def records(section, keep):
+        for _, record in iter_coco_records(path, (section,)):
+            if keep(record):
+                yield record
+
+    return (records('images', lambda image: image.get('id') in image_ids),
+            records('categories', lambda category: True),
+            records('annotations', lambda ann: ann.get('image_id') in image_ids))
+
+
+class CocoWriter:
+    """增量写 COCO 文件
+
+    images 和 annotations 分别先追加到临时文件，close() 时按 images、categories、annotations
+    的顺序拼接为最终文件，写入过程中内存只保留当前数据块。出错时调用 abort() 删除临时文件。
+    """
+
+    def __init__(self, path, categories):
+        self.path = path
+        self.categories = categories
+        self.image_count = 0
+        self.annotation_count = 0
+        self._images = open(path + '.images.tmp', 'w+', encoding='utf-8')
+        self._annotations = open(path + '.annotations.tmp', 'w+', encoding='utf-8')
+
+    def _write(self, f, records, count):
+        for record in records:
+            f.write((',' if count else '') + dumps_record(record) + '\n')
+            count += 1
+        return count
+
+    def extend_from(self, path):
+        """把已有 COCO 文件中的 images 和 annotations 写在本次内容之前（用于增量追加）
+
+        紧凑格式的文件按行复制，不解析 JSON；旧版缩进格式的文件整体读取后写入。
+        已有文件的 categories 不保留，使用本次的 categories。
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.readline().strip() != _section_header(0, SECTIONS[0]).strip():
+                f.seek(0)
+                coco = json.load(f)
+                self.write_images(coco.get('images', []))
+                self.write_annotations(coco.get('annotations', []))
+                return
+            section = SECTIONS[0]
+            for line in f:
+                if line.startswith(']'):
+                    section = line.rsplit('"', 2)[-2] if line.rstrip().endswith(':[') else None
+                    continue
+                record = line.lstrip(',')
+                if section == 'images':
+                    self._images.write((',' if self.image_count else '') + record)
+                    self.image_count += 1
+                elif section == 'annotations':
+                    self._annotations.write((',' if self.annotation_count else '') + record)
+                    self.annotation_count += 1
+
+    def write_images(self, images):
+        self.image_count = self._write(self._images, images, self.image_count)
+
+    def write_annotations(self, annotations):
+        self.annotation_count = self._write(self._annotations, annotations, self.annotation_count)
+
+    def close(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as out:
+                for i, section in enumerate(SECTIONS):
+                    out.write(_section_header(i, section))
+                    if section == 'categories':
+                        out.writelines(_record_lines(self.categories))
+                    else:
+                        f = self._images if section == 'images' else self._annotations
+                        f.seek(0)
+                        shutil.copyfileobj(f, out)
+                out.write(']}\n')
+            os.replace(tmp_path, self.path)
+        finally:
+            self._cleanup()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def abort(self):
+        self._cleanup()
+
+    def _cleanup(self):
+        for f in (self._images, self._annotations):
+            f.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -44,6 +44,29 @@ class MySQLClient:
             print(f"❌ 查询失败: {e}")
             return None
 
+    def query_chunks(self, sql, chunk_size=5000):
+        """使用服务端游标（SSCursor）流式查询，每次返回 chunk_size 行的 DataFrame"""
+        if self.connection is None:
+            print("⚠️ 数据库未连接，正在尝试重新连接...")
+            self.connect()
+            if self.connection is None:
+                raise RuntimeError("重新连接数据库失败")
+        cursor = self.connection.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(sql)
+            columns = [desc[0] for desc in cursor.description]
+            offset = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+                df.index = pd.RangeIndex(offset, offset + len(df))
+                offset += len(df)
+                yield df
+        finally:
+            cursor.close()
+
     def close(self):
         if self.connection:
             self.connection.close()
@@ -61,24 +84,26 @@ if '__main__' in __name__:
     SELECT * FROM `product_detection_detail_result`
     where ext like '%脏污%' and c_time BETWEEN "2025-10-22 00:00:00" and "2025-10-22 23:59:59"
     """
-    df = client.query(sql)
-    print(df.head())
-    print(df.keys())
-    # df = df[['c_time', 'origin_object_key', 'check_status', 'detection_result_status', 'manual_check_status']]
-    df['img_path'] = "E:/magic_fox_ai_20250826/resources/backend/local_file/" + df['origin_object_key']
     save_dir = "changanlier_2025-10-22-脏污"
     os.makedirs(save_dir, exist_ok=True)
-    for i, path in enumerate(df['img_path'].values):
-        img_name = os.path.basename(path)
-        save_path = os.path.join(save_dir, img_name)
-        if os.path.exists(save_path):
-            print(f'{img_name} 已存在, 同名覆盖')
-        if not os.path.exists(path):
-            print(f"{i}: {path} not find")
-            continue
-        shutil.copy2(path, save_path)
     csv_path = os.path.join(save_dir, 'result.csv')
-    df.to_csv(csv_path)
+    # 流式读取，逐批复制图片并追加写入 CSV
+    for chunk_idx, df in enumerate(client.query_chunks(sql)):
+        if chunk_idx == 0:
+            print(df.head())
+            print(df.keys())
+        # df = df[['c_time', 'origin_object_key', 'check_status', 'detection_result_status', 'manual_check_status']]
+        df['img_path'] = "E:/magic_fox_ai_20250826/resources/backend/local_file/" + df['origin_object_key']
+        for i, path in zip(df.index, df['img_path'].values):
+            img_name = os.path.basename(path)
+            save_path = os.path.join(save_dir, img_name)
+            if os.path.exists(save_path):
+                print(f'{img_name} 已存在, 同名覆盖')
+            if not os.path.exists(path):
+                print(f"{i}: {path} not find")
+                continue
+            shutil.copy2(path, save_path)
+        df.to_csv(csv_path, mode='w' if chunk_idx == 0 else 'a', header=chunk_idx == 0)
 
     from csv2coco import csv2coco
 
@@ -2,7 +2,17 @@ import os
 import sys
 import json
 import shutil
+import decimal
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from coco_writer import CocoWriter
+
+try:
+    import orjson  # 可选，安装后解析 infer_raw_result 更快
+except ImportError:
+    orjson = None
 
 
 # 默认 id2name 映射（如果未提供配置则使用）
@@ -14,9 +24,102 @@ DEFAULT_ID2NAME = {
     15: '褶皱(T型)', 16: '褶皱（重度）', 17: '重跳针'
 }
 
-def csv2coco(csv_file, coco_file, id2name=None):
+# 行数达到该值且提供了进程池时，才把 infer_raw_result 分批交给子进程解析
+PARALLEL_PARSE_MIN_ROWS = 4000
+PARSE_BATCH_SIZE = 1000
+
+
+def _loads(text):
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass  # orjson 不接受 NaN 等扩展写法，回退到标准库保证结果一致
+    return json.loads(text)
+
+
+def _extract_predictions(infer_raw_result):
     """
-    将csv文件导出为coco格式
+    解析单条 infer_raw_result，返回有效预测 (name, x, y, w, h, confidence, defect_type) 列表
+    解析失败时返回 None（该图片会被跳过）
+    """
+    # Ensure infer_raw_result is parsed if it is a string
+    if isinstance(infer_raw_result, str):
+        try:
+            infer_raw_result = _loads(infer_raw_result)
+        except Exception:
+            return None
+    if not isinstance(infer_raw_result, dict):
+        return []
+    predictions = []
+    for item in infer_raw_result.get('predictions') or []:
+        points = item.get('points', [])
+        if not points:
+            continue
+        # Only use the first point for bbox extraction
+        point = points[0]
+        x = point.get('x')
+        y = point.get('y')
+        w = point.get('w')
+        h = point.get('h')
+        if None in (x, y, w, h):
+            continue
+        predictions.append((item.get('name'), x, y, w, h, item.get('confidence'), item.get('defect_type')))
+    return predictions
+
+
+def _parse_batch(raw_results):
+    return [_extract_predictions(raw) for raw in raw_results]
+
+
+def parse_predictions(raw_results, executor=None):
+    """批量解析 infer_raw_result，提供进程池且行数较多时分批并行解析"""
+    batches = [raw_results[i:i + PARSE_BATCH_SIZE] for i in range(0, len(raw_results), PARSE_BATCH_SIZE)]
+    if executor is not None and len(raw_results) >= PARALLEL_PARSE_MIN_ROWS:
+        results = executor.map(_parse_batch, batches)
+    else:
+        results = map(_parse_batch, batches)
+    return [predictions for batch in results for predictions in batch]
+
+
+def _json_value(value):
+    """把数据库返回的时间、Decimal 等类型转换为可写入 JSON 的值"""
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _column(df, name):
+    """按列取值（不存在的列返回 None），与逐行 row.get(name) 得到的值一致"""
+    if name not in df.columns:
+        return [None] * len(df)
+    values = df[name].tolist()
+    if df[name].dtype.kind in 'biuf':
+        return values
+    return [_json_value(value) for value in values]
+
+
+def _areas(ws, hs):
+    """批量计算 w * h；类型一致时使用向量运算，否则逐个相乘以保持原有数值类型"""
+    value_types = {type(v) for v in ws} | {type(v) for v in hs}
+    if value_types == {int} or value_types == {float}:
+        return (np.asarray(ws) * np.asarray(hs)).tolist()
+    return [w * h for w, h in zip(ws, hs)]
+
+
+def df2coco(df, id2name=None, executor=None):
+    """
+    将查询结果 DataFrame 直接转换为 coco 字典（不经过 CSV），图片 id 使用 DataFrame 的索引
+
+    executor 可传入 ProcessPoolExecutor，用于并行解析大量 infer_raw_result
     """
     if id2name is None:
         id2name = DEFAULT_ID2NAME
@@ -25,67 +128,107 @@ def csv2coco(csv_file, coco_file, id2name=None):
     
     name2id = {v: k for k, v in id2name.items()}
     
-    df = pd.read_csv(csv_file, encoding="utf-8")
     coco = {
         "images": [],
-        "categories": [],
+        "categories": [{"id": k, "name": v} for k, v in sorted(id2name.items())],
         "annotations": []
     }
-    coco["categories"] = [{"id": k, "name": v} for k, v in sorted(id2name.items())]
-    for idx, row in df.iterrows():
-        img_path = row.get('img_path')
-        if pd.isna(img_path):
+    if df.empty:
+        return coco
+    
+    ids = df.index.tolist()
+    img_paths = _column(df, 'img_path')
+    # 多数据库查询时带有来源和加了来源前缀的文件名
+    img_names = _column(df, 'img_name')
+    sources = _column(df, 'source')
+    positions = _column(df, 'position')
+    product_ids = _column(df, 'product_id')
+    codes = _column(df, 'code')
+    c_times = _column(df, 'c_time')
+    check_statuses = _column(df, 'check_status')
+    raw_results = _column(df, 'infer_raw_result')
+    
+    # 只解析有图片路径且 check_status 为真值的行
+    valid = [not pd.isna(img_path) for img_path in img_paths]
+    parse_rows = [i for i in range(len(ids)) if valid[i] and check_statuses[i]]
+    parsed = dict(zip(parse_rows, parse_predictions([raw_results[i] for i in parse_rows], executor)))
+    
+    # 标注按列收集，最后统一计算面积并组装
+    ann_image_ids, ann_names, ann_boxes, ann_ws, ann_hs, ann_scores, ann_defect_types = [], [], [], [], [], [], []
+    for i, idx in enumerate(ids):
+        if not valid[i]:
             continue
         info = {
             "id": idx,
-            "file_name": str(os.path.basename(img_path)),
-            'position': row.get('position'),
-            'product_id': row.get('product_id'),
-            'SN': row.get('code'),
-            'c_time': row.get('c_time'),
+            "file_name": str(img_names[i] or os.path.basename(img_paths[i])),
+            'position': positions[i],
+            'product_id': product_ids[i],
+            'SN': codes[i],
+            'c_time': c_times[i],
         }
-        if row.get('check_status'):
-            info['check_status'] = row.get('check_status')
-            infer_raw_result = row.get('infer_raw_result')
-            # Ensure infer_raw_result is parsed if it is a string
-            if isinstance(infer_raw_result, str):
-                try:
-                    infer_raw_result = json.loads(infer_raw_result)
-                except Exception:
-                    continue  # skip if parsing fails
-            predictions = infer_raw_result.get('predictions', []) if infer_raw_result else []
-            for item in predictions:
-                points = item.get('points', [])
-                if not points:
-                    continue
-                # Only use the first point for bbox extraction
-                point = points[0]
-                x = point.get('x')
-                y = point.get('y')
-                w = point.get('w')
-                h = point.get('h')
-                if None in (x, y, w, h):
-                    continue
-                bbox = [x, y, w, h]
-
-                item_name = item.get('name')
-                # 如果名称不在映射中，跳过或使用默认值
-                if item_name not in name2id:
+        if sources[i] is not None:
+            info['source'] = sources[i]
+        if check_statuses[i]:
+            info['check_status'] = check_statuses[i]
+            predictions = parsed[i]
+            if predictions is None:
+                continue  # skip if parsing fails
+            for name, x, y, w, h, confidence, defect_type in predictions:
+                # 如果名称不在映射中，跳过
+                if not isinstance(name, str) or name not in name2id:
                     continue
-                
-                annotation = {
-                    "image_id": idx,
-                    "category_id": name2id[item_name],
-                    "bbox": bbox,
-                    'area': w * h,
-                    "score": item.get('confidence'),
-                    "category": item_name,
-                    "defect_type": item.get('defect_type')
-                }
-                coco["annotations"].append(annotation)   
+                ann_image_ids.append(idx)
+                ann_names.append(name)
+                ann_boxes.append([x, y, w, h])
+                ann_ws.append(w)
+                ann_hs.append(h)
+                ann_scores.append(confidence)
+                ann_defect_types.append(defect_type)
         coco["images"].append(info)
-    with open(coco_file, "w", encoding="utf-8") as f:
-        json.dump(coco, f, ensure_ascii=False, indent=4)
+    
+    areas = _areas(ann_ws, ann_hs)
+    coco["annotations"] = [
+        {
+            "image_id": image_id,
+            "category_id": name2id[name],
+            "bbox": bbox,
+            'area': area,
+            "score": score,
+            "category": name,
+            "defect_type": defect_type
+        }
+        for image_id, name, bbox, area, score, defect_type
+        in zip(ann_image_ids, ann_names, ann_boxes, areas, ann_scores, ann_defect_types)
+    ]
+    return coco
+
+
+def csv2coco(csv_file, coco_file, id2name=None, chunksize=None, workers=None):
+    """
+    将csv文件导出为coco格式
+
+    指定 chunksize 时按批读取 CSV，避免一次性把整个结果集载入内存；
+    workers 大于 1 时使用进程池并行解析 infer_raw_result；
+    输出为紧凑格式（每条记录一行），可用 coco_writer.iter_coco_records 按行读取
+    """
+    if chunksize:
+        # 分批读取时 pandas 会保持索引连续递增，图片 id 与整表读取一致
+        frames = pd.read_csv(csv_file, encoding="utf-8", chunksize=chunksize)
+    else:
+        frames = [pd.read_csv(csv_file, encoding="utf-8")]
+    
+    executor = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    try:
+        # 逐批转换并增量写出（紧凑格式），内存中只保留当前批次
+        categories = df2coco(pd.DataFrame(), id2name)["categories"]
+        with CocoWriter(coco_file, categories) as writer:
+            for df in frames:
+                part = df2coco(df, id2name, executor)
+                writer.write_images(part["images"])
+                writer.write_annotations(part["annotations"])
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 def copy_ng_images(coco_file, all_images_dir, ng_images_dir):
     """
@@ -105,5 +248,5 @@ def copy_ng_images(coco_file, all_images_dir, ng_images_dir):
 if __name__ == "__main__":
     csv_file  = sys.argv[1]
     coco_file = sys.argv[2]
-    csv2coco(csv_file, coco_file, DEFAULT_ID2NAME)
+    csv2coco(csv_file, coco_file, DEFAULT_ID2NAME, workers=os.cpu_count())
     # copy_ng_images(coco_file, "导出结果/images", "ng_images")
\ No newline at end of file
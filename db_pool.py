@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """在 checkout_timeout 内没有可用连接"""
+
+
+class PoolClosed(Exception):
+    """连接池已关闭（例如配置更新后被替换）"""
+
+
+class ConnectionPool:
+    """线程安全的数据库连接池
+
+    - 连接数在 min_size ~ max_size 之间，不足时按需创建
+    - 每次取出连接时先 ping 检查，失效的连接会被丢弃并重新获取
+    - 空闲超过 idle_timeout 秒的连接会被关闭（至少保留 min_size 个）
+    - 连接用尽时最多等待 checkout_timeout 秒，超时抛出 PoolTimeout
+    """
+
+    def __init__(self, connect, min_size=1, max_size=5, checkout_timeout=30, idle_timeout=300):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self._idle = deque()  # (connection, 归还时间)
+        self._size = 0        # 已打开的连接数（空闲 + 使用中）
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'destroyed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'failed_pings': 0
+        }
+        # 预先创建 min_size 个连接，数据库不可用时在这里直接报错
+        try:
+            for _ in range(min_size):
+                conn = self._connect()
+                with self._cond:
+                    self._size += 1
+                    self._stats['created'] += 1
+                    self._idle.append((conn, time.monotonic()))
+        except Exception:
+            self.close()
+            raise
+
+    def _close_conn(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._stats['destroyed'] += 1
+
+    def _evict_idle_locked(self):
+        """关闭空闲过久的连接（从最久未使用的一端开始）"""
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._close_conn(conn)
+
+    def acquire(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolClosed('连接池已关闭')
+                    self._evict_idle_locked()
+                    if self._idle:
+                        conn, _ = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f'等待数据库连接超时（{timeout} 秒）')
+                    self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                # 新建连接（不持有锁，避免阻塞其他线程）
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats['created'] += 1
+                    self._stats['checkouts'] += 1
+                return conn
+
+            # 取出的空闲连接先做健康检查
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._stats['failed_pings'] += 1
+                    self._close_conn(conn)
+                    self._cond.notify()
+                continue
+            with self._cond:
+                self._stats['checkouts'] += 1
+            return conn
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            if self._closed or discard:
+                self._size -= 1
+                self._close_conn(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """取出一个连接，使用完毕后自动归还；执行出错或生成器提前关闭时丢弃该连接
+
+        生成器提前关闭（GeneratorExit）时连接上可能还有未读完的流式结果，读完需要传输剩余的全部数据，
+        直接关闭连接代价更小。
+        """
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except BaseException:
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self):
+        """关闭连接池：立即关闭空闲连接，使用中的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_conn(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._stats,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                min_size=self.min_size,
+                max_size=self.max_size,
+                closed=self._closed
+            )
@@ -0,0 +1,105 @@
+import os
+import queue
+import threading
+
+import pandas as pd
+
+SOURCE_COLUMN = 'source'
+
+# 数据库目标的配置字段（未指定的连接参数使用默认数据库的配置）
+TARGET_FIELDS = ('host', 'user', 'password', 'database', 'img_base_path', 'pool_max')
+
+
+def normalize_targets(raw_targets):
+    """校验配置中的 db_targets，返回 {名称: 配置}，格式不正确时抛出 ValueError"""
+    targets = {}
+    for target in raw_targets or []:
+        if not isinstance(target, dict) or not target.get('name'):
+            raise ValueError('db_targets 中的每一项都需要 name')
+        name = str(target['name'])
+        if name in targets:
+            raise ValueError(f'数据库目标重名: {name}')
+        if '/' in name or '\\' in name:
+            raise ValueError(f'数据库目标名称不能包含路径分隔符: {name}')
+        targets[name] = {field: target[field] for field in TARGET_FIELDS if target.get(field) not in (None, '')}
+    return targets
+
+
+def source_filename(source, img_path):
+    """多数据库查询时的图片文件名：加上来源前缀，避免不同产线的同名图片互相覆盖"""
+    return f'{source}_{os.path.basename(img_path)}'
+
+
+_DONE = object()
+
+
+def iter_fanout_frames(sources, chunk_size=5000, queue_size=None, on_source_done=None):
+    """并发执行多个数据库的查询，按到达顺序逐块返回 DataFrame
+
+    sources 为 [(名称, 客户端, SQL)]，每个数据库在独立线程中流式读取（各自使用自己的连接池），
+    先返回的数据块先处理，慢的数据库不会阻塞其他数据库。每个数据块只来自一个数据库，
+    带有 source 列；索引在所有数据库间连续递增，作为不冲突的图片 id。
+    队列最多缓存 queue_size 个数据块，处理跟不上时读取线程等待。
+    某个数据库查询失败时不影响其他数据库，on_source_done(名称, 行数, 错误) 在每个数据库结束时调用；
+    所有数据库都失败时抛出最后一个错误。
+    """
+    chunks = queue.Queue(maxsize=queue_size or 2 * len(sources))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(name, client, sql):
+        rows = 0
+        error = None
+        try:
+            frames = client.query_chunks(sql, chunk_size)
+            try:
+                for df in frames:
+                    if df.empty:
+                        continue
+                    df[SOURCE_COLUMN] = name
+                    rows += len(df)
+                    if not put(df):
+                        break
+            finally:
+                # 提前结束时关闭生成器，归还连接
+                close = getattr(frames, 'close', None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            print(f"❌ 数据库 {name} 查询失败: {e}")
+            error = e
+        put((_DONE, name, rows, error))
+
+    threads = [threading.Thread(target=fetch, args=source, name=f'query-fanout-{source[0]}', daemon=True)
+               for source in sources]
+    for thread in threads:
+        thread.start()
+    try:
+        offset = 0
+        remaining = len(sources)
+        errors = []
+        while remaining:
+            item = chunks.get()
+            if isinstance(item, tuple) and item[0] is _DONE:
+                _, name, rows, error = item
+                remaining -= 1
+                if error is not None:
+                    errors.append(error)
+                if on_source_done is not None:
+                    on_source_done(name, rows, error)
+                continue
+            item.index = pd.RangeIndex(offset, offset + len(item))
+            offset += len(item)
+            yield item
+        if errors and len(errors) == len(sources):
+            raise errors[-1]
+    finally:
+        stop.set()
@@ -0,0 +1,65 @@
+import os
+import json
+from datetime import datetime, date
+
+import pandas as pd
+
+QUERY_INFO_FILE = 'query.json'
+
+
+def _sql_literal(value):
+    """时间值转为 SQL 字符串常量"""
+    if isinstance(value, (pd.Timestamp, datetime)):
+        value = value.strftime('%Y-%m-%d %H:%M:%S.%f').rstrip('0').rstrip('.')
+    elif isinstance(value, date):
+        value = value.isoformat()
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def high_water_mark(df, time_field, key_field, current=None):
+    """返回数据块与 current 中最大的 (时间, 主键)，列不存在或没有有效值时返回 current
+
+    时间相同的行按主键区分，保证下次只取严格更新的行。
+    """
+    if time_field not in df.columns or key_field not in df.columns:
+        return current
+    times = pd.to_datetime(df[time_field], errors='coerce')
+    keys = pd.to_numeric(df[key_field], errors='coerce')
+    valid = times.notna() & keys.notna()
+    if not valid.any():
+        return current
+    times, keys = times[valid], keys[valid]
+    latest = times.max()
+    key = int(keys[times == latest].max())
+    if current is not None:
+        current_time = pd.Timestamp(current[0])
+        if (current_time, current[1]) >= (latest, key):
+            return current
+    return latest.strftime('%Y-%m-%d %H:%M:%S.%f'), key
+
+
+def tail_sql(sql, time_field, key_field, mark):
+    """在原查询外按高水位过滤，只取 (时间, 主键) 严格大于 mark 的行，并按时间、主键排序"""
+    inner = sql.strip().rstrip(';')
+    mark_time = _sql_literal(pd.Timestamp(mark[0]))
+    mark_key = int(mark[1])
+    return (f"SELECT * FROM ({inner}) AS _tail "
+            f"WHERE `{time_field}` > {mark_time} OR (`{time_field}` = {mark_time} AND `{key_field}` > {mark_key}) "
+            f"ORDER BY `{time_field}`, `{key_field}`")
+
+
+def save_query_info(task_dir, info):
+    """保存任务的查询信息（SQL 模板、导出模式、结果行数和高水位），用于增量追加"""
+    tmp_path = os.path.join(task_dir, QUERY_INFO_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(task_dir, QUERY_INFO_FILE))
+
+
+def load_query_info(task_dir):
+    """读取任务的查询信息，旧任务没有该文件时返回 None"""
+    path = os.path.join(task_dir, QUERY_INFO_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，多进程部署时各进程都会执行清理
+    fcntl = None
+
+# exports/ 下以下划线开头的条目（图片仓库、过期记录）不是任务目录
+TOMBSTONE_FILE = '_expired.jsonl'
+LOCK_FILE = '_janitor.lock'
+# 旧版导出留下的临时文件：根目录下的 ZIP、任务目录中的筛选 COCO 文件和 .tmp 文件
+ORPHAN_ROOT_SUFFIXES = ('.zip', '.tmp')
+ORPHAN_TASK_FILES = ('_annotations_filtered.coco.json',)
+
+
+class ExportJanitor:
+    """exports/ 的后台清理线程
+
+    - 任务最后访问时间超过 max_age 秒时删除任务目录
+    - 所有任务占用的空间超过 max_bytes 时按最后访问时间（LRU）删除任务，直到降到上限的 90%
+    - 删除超过 orphan_age 秒仍未被清理的 ZIP、筛选 COCO 和 .tmp 文件
+    - 删除任务后回收不再被引用的图片仓库文件
+
+    最后访问时间记录在任务目录的修改时间上（touch 时更新），重启后仍然有效。
+    被删除的任务记录在 _expired.jsonl 中，接口据此返回“任务已过期”而不是“任务不存在”。
+    多个 worker 进程共用 exports/ 时，通过 _janitor.lock 文件锁保证同一时间只有一个进程在清理，
+    其他进程写入的过期记录在查询时增量读取。
+    is_active(task_id) 返回 True 的任务（仍在执行）不会被删除；on_evict(task_id) 在删除目录前调用，
+    用于清理任务索引和结果缓存。max_bytes、max_age 为 0 表示不限制。
+    """
+
+    def __init__(self, root, max_bytes=0, max_age=0, interval=600, orphan_age=3600,
+                 blob_store=None, is_active=None, on_evict=None, max_tombstones=100000):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.orphan_age = orphan_age
+        self.blob_store = blob_store
+        self.is_active = is_active or (lambda task_id: False)
+        self.on_evict = on_evict
+        self.max_tombstones = max_tombstones
+        self._touched = {}  # task_id → 最近一次写入目录修改时间的时间，避免每个请求都写磁盘
+        self._tombstones = {}  # task_id → {'expired_at', 'reason'}
+        self._tombstone_offset = 0  # 已读取的过期记录文件长度
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.evicted = 0
+        self.freed_bytes = 0
+        self.last_sweep = None
+        os.makedirs(self.root, exist_ok=True)
+        self._load_tombstones()
+
+    def _task_dir(self, task_id):
+        return os.path.join(self.root, task_id)
+
+    def _read_tombstones_locked(self):
+        """读取过期记录文件中新追加的完整行（包括其他进程写入的记录）"""
+        path = os.path.join(self.root, TOMBSTONE_FILE)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size < self._tombstone_offset:
+            self._tombstone_offset = 0  # 文件已被重写
+        if size == self._tombstone_offset:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self._tombstone_offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        self._tombstone_offset += end
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+                self._tombstones[entry['task_id']] = {'expired_at': entry['expired_at'], 'reason': entry['reason']}
+            except (ValueError, KeyError):
+                continue
+
+    def _load_tombstones(self):
+        with self._lock:
+            self._read_tombstones_locked()
+            if len(self._tombstones) <= self.max_tombstones:
+                return
+            # 只保留最近的记录并重写文件
+            path = os.path.join(self.root, TOMBSTONE_FILE)
+            recent = sorted(self._tombstones.items(), key=lambda item: item[1]['expired_at'])[-self.max_tombstones:]
+            self._tombstones = dict(recent)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for task_id, entry in recent:
+                    f.write(json.dumps(dict(entry, task_id=task_id)) + '\n')
+            os.replace(tmp_path, path)
+            self._tombstone_offset = os.path.getsize(path)
+
+    def _add_tombstone(self, task_id, reason):
+        entry = {'expired_at': time.time(), 'reason': reason}
+        with self._lock:
+            self._tombstones[task_id] = entry
+            self._touched.pop(task_id, None)
+            with open(os.path.join(self.root, TOMBSTONE_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(entry, task_id=task_id)) + '\n')
+
+    def is_expired(self, task_id):
+        """任务目录是否已被清理（而不是从未存在）"""
+        with self._lock:
+            if task_id not in self._tombstones:
+                self._read_tombstones_locked()
+            return task_id in self._tombstones
+
+    def touch(self, task_id, min_interval=60):
+        """记录任务被访问，同一任务 min_interval 秒内只更新一次目录修改时间"""
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(task_id, 0) < min_interval:
+                return
+            self._touched[task_id] = now
+        try:
+            os.utime(self._task_dir(task_id), (now, now))
+        except OSError:
+            pass
+
+    def _blob_inodes(self):
+        """图片仓库文件的 inode → (大小, 引用数)，用于把共享图片的空间分摊到各任务"""
+        return self.blob_store.inodes() if self.blob_store is not None else {}
+
+    def _task_bytes(self, task_dir, blob_inodes):
+        """任务占用的空间：独占文件的大小 + 按引用数分摊的仓库图片大小（直接硬链接的原图不计入）"""
+        nbytes = 0
+        for root, _, files in os.walk(task_dir):
+            for filename in files:
+                try:
+                    st = os.stat(os.path.join(root, filename))
+                except OSError:
+                    continue
+                if st.st_nlink <= 1:
+                    nbytes += st.st_size
+                else:
+                    size, refs = blob_inodes.get((st.st_dev, st.st_ino), (0, 1))
+                    nbytes += size // max(refs, 1)
+        return nbytes
+
+    def _scan_tasks(self):
+        """返回 [(最后访问时间, task_id, 占用字节数)]，跳过仍在执行的任务"""
+        blob_inodes = self._blob_inodes()
+        tasks = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith('_') or not entry.is_dir(follow_symlinks=False):
+                    continue
+                if self.is_active(entry.name):
+                    continue
+                try:
+                    accessed = entry.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    continue
+                tasks.append((accessed, entry.name, self._task_bytes(entry.path, blob_inodes)))
+        tasks.sort()
+        return tasks
+
+    def _remove_orphans(self, now):
+        removed = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        candidates = [entry] if entry.name.endswith(ORPHAN_ROOT_SUFFIXES) else []
+                    elif entry.is_dir(follow_symlinks=False) and not self.is_active(entry.name):
+                        # 执行中的任务正在写临时文件（copy2 会保留源文件的修改时间），不能按时间判断
+                        with os.scandir(entry.path) as children:
+                            candidates = [child for child in children if child.is_file(follow_symlinks=False)
+                                          and (child.name in ORPHAN_TASK_FILES or child.name.endswith('.tmp'))]
+                    else:
+                        continue
+                    for candidate in candidates:
+                        if now - candidate.stat(follow_symlinks=False).st_mtime > self.orphan_age:
+                            os.remove(candidate.path)
+                            removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def evict(self, task_id, reason):
+        """删除任务目录并留下过期记录"""
+        if self.on_evict is not None:
+            self.on_evict(task_id)
+        self._add_tombstone(task_id, reason)
+        shutil.rmtree(self._task_dir(task_id), ignore_errors=True)
+
+    def sweep(self):
+        """执行一次清理，返回本次删除的任务数、孤立文件数和释放的空间；其他进程正在清理时返回 None"""
+        with self._sweep_lock, open(os.path.join(self.root, LOCK_FILE), 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            now = time.time()
+            orphans = self._remove_orphans(now)
+            tasks = self._scan_tasks()
+            evicted = 0
+            freed = 0
+
+            keep = []
+            for accessed, task_id, nbytes in tasks:
+                if self.max_age and now - accessed > self.max_age:
+                    self.evict(task_id, 'max_age')
+                    evicted += 1
+                    freed += nbytes
+                else:
+                    keep.append((accessed, task_id, nbytes))
+
+            total = sum(nbytes for _, _, nbytes in keep)
+            if self.max_bytes and total > self.max_bytes:
+                target = self.max_bytes * 0.9
+                # 最后访问时间最早的任务先删除，至少保留最近访问的一个
+                for accessed, task_id, nbytes in keep[:-1]:
+                    if total <= target:
+                        break
+                    self.evict(task_id, 'max_bytes')
+                    evicted += 1
+                    freed += nbytes
+                    total -= nbytes
+
+            if evicted and self.blob_store is not None:
+                self.blob_store.gc()
+
+            self.evicted += evicted
+            self.freed_bytes += freed
+            self.last_sweep = {'at': now, 'evicted': evicted, 'orphans': orphans, 'freed_bytes': freed,
+                               'tasks': len(tasks) - evicted, 'bytes': total if self.max_bytes else None}
+            if evicted or orphans:
+                print(f"✅ 清理导出目录: 删除 {evicted} 个任务、{orphans} 个临时文件，释放约 {freed / 1024 / 1024:.1f} MB")
+            return self.last_sweep
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ 清理导出目录失败: {e}")
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='export-janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            tombstones = len(self._tombstones)
+        return {
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'interval': self.interval,
+            'evicted': self.evicted,
+            'freed_bytes': self.freed_bytes,
+            'expired_tasks': tombstones,
+            'last_sweep': self.last_sweep
+        }
@@ -0,0 +1,238 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueryJob:
+    """后台查询任务，记录各阶段进度和已产生的部分结果
+
+    执行期间只在内存中保留前 max_items 条部分结果（None 表示不限制），任务结束后清空，
+    完成的任务从任务索引分页读取结果。
+    """
+
+    def __init__(self, task_id, max_items=None):
+        self.task_id = task_id
+        self.status = 'pending'  # pending / running / done / failed
+        self.stage = 'queued'    # queued / fetching / coco / finished
+        self.progress = {
+            'rows_fetched': 0,
+            'images_copied': 0,
+            'images_linked': 0,
+            'images_skipped': 0,
+            'images_missing': 0,
+            'coco_built': False
+        }
+        self.items = []
+        self.max_items = max_items
+        self.count = 0  # 已产生的结果条数（包括没有保留在 items 中的）
+        self.base_count = 0  # 增量追加时已有的结果条数，items 从该位置开始
+        self.missing = []  # 不存在的图片路径（按发现顺序，不重复）
+        self._missing_set = set()
+        self.timings = {}  # 阶段 → 累计耗时（秒）
+        self.error = None
+        self.message = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.listener = None  # listener(job, force) 在状态或进度变化后调用，用于同步到共享存储
+        self._lock = threading.Lock()
+
+    def _notify(self, force=False):
+        if self.listener is not None:
+            self.listener(self, force)
+
+    def start(self):
+        with self._lock:
+            self.status = 'running'
+        self._notify(force=True)
+
+    def set_stage(self, stage):
+        with self._lock:
+            self.stage = stage
+        self._notify(force=True)
+
+    def add_progress(self, **counters):
+        """累加计数类进度（行数、图片数）"""
+        with self._lock:
+            for key, value in counters.items():
+                self.progress[key] = self.progress.get(key, 0) + value
+        self._notify()
+
+    def set_progress(self, **values):
+        with self._lock:
+            self.progress.update(values)
+        self._notify()
+
+    def add_timing(self, stage, seconds):
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def add_missing(self, paths):
+        """记录不存在的图片路径，并累加 images_missing 进度"""
+        with self._lock:
+            for path in paths:
+                if path not in self._missing_set:
+                    self._missing_set.add(path)
+                    self.missing.append(path)
+                    self.progress['images_missing'] += 1
+        self._notify()
+
+    def add_items(self, items):
+        with self._lock:
+            self.count += len(items)
+            room = len(items) if self.max_items is None else max(self.max_items - len(self.items), 0)
+            self.items.extend(items[:room])
+        self._notify()
+
+    def finish(self, message=None, keep_items=False):
+        """标记任务完成；结果已保存到任务索引时清空部分结果，keep_items 为 True 时保留（没有生成任务索引）"""
+        with self._lock:
+            self.status = 'done'
+            self.stage = 'finished'
+            self.message = message
+            self.finished_at = time.time()
+            if not keep_items:
+                self.items = []
+        self._notify(force=True)
+
+    def fail(self, error):
+        with self._lock:
+            self.status = 'failed'
+            self.error = error
+            self.finished_at = time.time()
+            self.items = []
+        self._notify(force=True)
+
+    def snapshot(self, offset=0, limit=None, include_missing=True):
+        """返回可序列化的任务状态，data 只包含 offset 之后的结果（limit 限制条数，0 表示只返回状态）
+
+        增量追加的任务只保存新增的结果，offset 小于 base_count 时从 base_count 开始返回；
+        超出保留范围（max_items）或任务结束后已清空的结果不返回，由调用方从任务索引读取。
+        missing 为目前发现的全部缺失图片路径，include_missing 为 False 时不返回（只看 images_missing 计数）。
+        """
+        with self._lock:
+            offset = max(offset, self.base_count)
+            start = offset - self.base_count
+            end = None if limit is None else start + limit
+            return {
+                'task_id': self.task_id,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': dict(self.progress),
+                'count': self.base_count + self.count,
+                'offset': offset,
+                'data': self.items[start:end],
+                'missing': list(self.missing) if include_missing else None,
+                'error': self.error,
+                'message': self.message,
+                'timings': {stage: round(seconds, 4) for stage, seconds in self.timings.items()},
+                'elapsed': round((self.finished_at or time.time()) - self.created_at, 3)
+            }
+
+
+class JobManager:
+    """使用有界线程池执行查询任务，按 task_id 保存任务状态
+
+    指定 store（JobStateStore）时，任务状态和进度同步写入共享存储（进度最多每 publish_interval 秒写一次），
+    其他 worker 进程可以通过 get_state() 查询本进程执行的任务。
+    """
+
+    def __init__(self, max_workers=1, keep_seconds=3600, store=None, publish_interval=0.5, max_items=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query-job')
+        self.keep_seconds = keep_seconds
+        self.store = store
+        self.publish_interval = publish_interval
+        self.max_items = max_items  # 每个任务执行期间在内存中保留的部分结果条数
+        self._jobs = {}
+        self._published_at = {}  # task_id → 最近一次写入共享存储的时间
+        self._lock = threading.Lock()
+
+    def _publish(self, job, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._published_at.get(job.task_id, 0) < self.publish_interval:
+                return
+            self._published_at[job.task_id] = now
+        try:
+            self.store.save(job.snapshot(limit=0, include_missing=False), job.created_at, job.finished_at)
+        except Exception as e:
+            print(f"⚠️ 同步任务状态失败: {e}")
+
+    def submit(self, task_id, func, *args, **kwargs):
+        """创建任务并提交到线程池，func 的第一个参数为 QueryJob"""
+        job = QueryJob(task_id, max_items=self.max_items)
+        if self.store is not None:
+            job.listener = self._publish
+            self._publish(job, force=True)
+        with self._lock:
+            self._expire_locked()
+            self._jobs[task_id] = job
+
+        def run():
+            job.start()
+            try:
+                func(job, *args, **kwargs)
+            except Exception as e:
+                print(f"❌ 查询任务 {task_id} 失败: {e}")
+                job.fail(str(e))
+            else:
+                if job.status == 'running':
+                    job.finish()
+
+        self.executor.submit(run)
+        return job
+
+    def get(self, task_id):
+        """返回本进程的任务
+
+        本进程的任务已结束、而其他进程之后又执行了同一任务（增量追加）时，本地任务已过时，
+        丢弃并返回 None，调用方改为查询共享存储和任务文件。
+        """
+        with self._lock:
+            job = self._jobs.get(task_id)
+        if job is None or job.finished_at is None or self.store is None:
+            return job
+        try:
+            created_at = self.store.created_at(task_id)
+        except Exception as e:
+            print(f"⚠️ 读取任务状态失败: {e}")
+            return job
+        if created_at is not None and created_at > job.created_at:
+            with self._lock:
+                if self._jobs.get(task_id) is job:
+                    del self._jobs[task_id]
+                    self._published_at.pop(task_id, None)
+            return None
+        return job
+
+    def get_state(self, task_id):
+        """返回任务状态（不含结果数据）：本进程的任务直接取快照，否则查询共享存储"""
+        job = self.get(task_id)
+        if job is not None:
+            return job.snapshot(limit=0, include_missing=False)
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(task_id)
+        except Exception as e:
+            print(f"⚠️ 读取任务状态失败: {e}")
+            return None
+
+    def counts(self):
+        """按状态统计当前保存的任务数"""
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in ('pending', 'running', 'done', 'failed')}
+
+    def _expire_locked(self):
+        """清理已结束且超过保留时间的任务"""
+        now = time.time()
+        expired = [task_id for task_id, job in self._jobs.items()
+                   if job.finished_at and now - job.finished_at > self.keep_seconds]
+        for task_id in expired:
+            del self._jobs[task_id]
+            self._published_at.pop(task_id, None)
+        if expired and self.store is not None:
+            try:
+                self.store.expire()
+            except Exception as e:
+                print(f"⚠️ 清理任务状态失败: {e}")
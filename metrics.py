@@ -0,0 +1,214 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 阶段耗时的直方图分桶（秒），覆盖单张图片到大批量查询
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels → [各分桶计数（非累积）..., +Inf 计数, 总和]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for le, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", _format_value(float(le))))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """抓取时才调用 func 取值的指标，用于连接池、缓存等已有统计，不增加热路径开销
+
+    func 返回数值（无标签）或 {标签值元组: 数值}。
+    """
+
+    def __init__(self, name, documentation, func, labelnames=(), type_name='gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+        self.type_name = type_name
+
+    def samples(self):
+        try:
+            values = self.func()
+        except Exception as e:
+            print(f"⚠️ 读取指标 {self.name} 失败: {e}")
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in values.items() if value is not None]
+
+
+class Registry:
+    """Prometheus 文本格式的指标注册表（不依赖 prometheus_client）"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, func, labelnames=(), type_name='gauge'):
+        return self._register(CallbackMetric(name, documentation, func, labelnames, type_name))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            samples = metric.samples()
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Stopwatch:
+    """累计一个请求或一个查询任务中各阶段的耗时
+
+    同一阶段多次计时（例如每个数据块）时耗时相加；flush() 把各阶段总耗时记入直方图，
+    server_timing() 生成 Server-Timing 响应头。on_add(stage, seconds) 在每次计时后调用。
+    """
+
+    def __init__(self, histogram=None, operation=None, on_add=None):
+        self.histogram = histogram
+        self.operation = operation
+        self.on_add = on_add
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._flushed = False
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        if self.on_add is not None:
+            self.on_add(stage, seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def iter(self, stage, iterable):
+        """逐项计时地迭代（计入取下一项的耗时，例如等待数据库返回数据块）"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.timings)
+
+    def flush(self):
+        """把各阶段总耗时记入直方图（只记录一次）"""
+        with self._lock:
+            if self._flushed:
+                return
+            self._flushed = True
+            timings = dict(self.timings)
+        if self.histogram is not None:
+            for stage, seconds in timings.items():
+                self.histogram.observe(seconds, operation=self.operation, stage=stage)
+
+
+def server_timing(timings, prefix=''):
+    """{阶段: 秒} → Server-Timing 头的值（毫秒）"""
+    return ', '.join(f'{prefix}{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items())
@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Windows 的共享目录不区分大小写，按小写比较文件名
+_normcase = os.path.normcase
+
+
+class PathProbe:
+    """批量检查图片路径是否存在，按目录列举并缓存结果
+
+    图片目录是网络共享时每次 os.path.exists 都是一次网络往返。probe() 把路径按所在目录分组，
+    每个目录只列举一次（多个目录并行列举），5 万条路径只需要“目录数”次往返。
+    目录列举结果和单个路径的检查结果缓存 ttl 秒；缓存期内新出现的文件可能被当作不存在。
+    """
+
+    def __init__(self, ttl=60, max_workers=16, max_entries=4096):
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.max_entries = max_entries  # 目录缓存和路径缓存各自的条目上限
+        self._dirs = OrderedDict()  # 目录 → (列举时间, 文件名集合；目录不存在时为 None)
+        self._paths = OrderedDict()  # 单独检查的路径 → (检查时间, 是否存在)
+        self._stats = OrderedDict()  # 路径 → (检查时间, os.stat_result；不存在时为 None)
+        self._lock = threading.Lock()
+        self.listings = 0
+        self.stats_calls = 0
+        self.hits = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='path-probe')
+
+    def _cached(self, cache, key, now):
+        entry = cache.get(key)
+        if entry is None or now - entry[0] >= self.ttl:
+            return None
+        cache.move_to_end(key)
+        return entry
+
+    def _store(self, cache, key, value):
+        cache[key] = (time.time(), value)
+        cache.move_to_end(key)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def _list_dir(self, directory):
+        """列举目录中的文件名；目录不存在时返回 None，无法列举（权限、网络错误）时返回 False 且不缓存"""
+        try:
+            with os.scandir(directory or '.') as entries:
+                names = frozenset(_normcase(entry.name) for entry in entries)
+        except (FileNotFoundError, NotADirectoryError):
+            names = None
+        except OSError as e:
+            print(f"⚠️ 无法列举图片目录 {directory}: {e}")
+            return False
+        with self._lock:
+            self.listings += 1
+            self._store(self._dirs, directory, names)
+        return names
+
+    def _listing(self, directory, now):
+        with self._lock:
+            entry = self._cached(self._dirs, directory, now)
+        return entry
+
+    def probe(self, paths):
+        """返回 paths 中不存在的路径列表（保持原顺序，忽略空值；无法列举的目录中的路径不计入）"""
+        now = time.time()
+        by_dir = {}
+        for path in paths:
+            if path and isinstance(path, str):
+                directory, name = os.path.split(path)
+                by_dir.setdefault(directory, []).append((path, name))
+
+        listings = {}
+        to_list = []
+        for directory in by_dir:
+            entry = self._listing(directory, now)
+            if entry is None:
+                to_list.append(directory)
+            else:
+                listings[directory] = entry[1]
+        with self._lock:
+            self.hits += len(listings)
+        if to_list:
+            # 目录列举是网络往返，并行执行
+            for directory, names in zip(to_list, self.executor.map(self._list_dir, to_list)):
+                listings[directory] = names
+
+        missing = set()
+        for directory, items in by_dir.items():
+            names = listings[directory]
+            if names is False:
+                continue
+            for path, name in items:
+                if names is None or _normcase(name) not in names:
+                    missing.add(path)
+        return [path for path in paths if path in missing]
+
+    def exists(self, path):
+        """检查单个路径：目录列举在缓存中时直接查找，否则 stat 一次并缓存结果"""
+        now = time.time()
+        directory, name = os.path.split(path)
+        with self._lock:
+            entry = self._cached(self._dirs, directory, now)
+            if entry is None:
+                entry = self._cached(self._paths, path, now)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[1]
+            else:
+                self.hits += 1
+                return entry[1] is not None and _normcase(name) in entry[1]
+        exists = os.path.exists(path)
+        with self._lock:
+            self.stats_calls += 1
+            self._store(self._paths, path, exists)
+        return exists
+
+    def stat(self, path):
+        """返回路径的 os.stat 结果（缓存 ttl 秒），不存在时返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._cached(self._stats, path, now)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            listing = self._cached(self._dirs, os.path.dirname(path), now)
+            if listing is not None and (listing[1] is None or _normcase(os.path.basename(path)) not in listing[1]):
+                # 目录列举中没有该文件，不再访问共享目录
+                self.hits += 1
+                return None
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        with self._lock:
+            self.stats_calls += 1
+            self._store(self._stats, path, st)
+        return st
+
+    def invalidate(self, path=None):
+        """清除缓存（path 为空时全部清除）"""
+        with self._lock:
+            if path is None:
+                self._dirs.clear()
+                self._paths.clear()
+                self._stats.clear()
+            else:
+                self._dirs.pop(os.path.dirname(path), None)
+                self._paths.pop(path, None)
+                self._stats.pop(path, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ttl': self.ttl,
+                'dirs': len(self._dirs),
+                'paths': len(self._paths) + len(self._stats),
+                'listings': self.listings,
+                'stat_calls': self.stats_calls,
+                'hits': self.hits,
+                'misses': self.listings + self.stats_calls
+            }
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# 字符串常量和反引号标识符，规范化 SQL 时保持原样
+_QUOTED = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""")
+
+# 影响查询结果内容（CSV、图片路径、COCO 类别）的配置项
+FINGERPRINT_FIELDS = (
+    'db_host', 'db_user', 'db_database',
+    'img_path_mode', 'img_base_path', 'img_path_field', 'img_full_path_field',
+    'id2name', 'sample_seed'
+)
+
+
+def normalize_sql(sql):
+    """合并字符串常量以外的连续空白，去掉首尾空白和末尾分号"""
+    parts = _QUOTED.split(sql.strip().rstrip(';').strip())
+    # split 结果中奇数位置是引号内容
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+
+
+def make_cache_key(sql, app_config, sample_size=None, export_mode=None, shards=None, targets=None):
+    """替换时间变量后的 SQL + 数据库/路径配置指纹 + 采样数量、导出模式和分片数（分片查询的结果顺序不同）
+
+    targets 为多数据库查询的各数据库配置（不含密码）。
+    """
+    payload = {
+        'sql': normalize_sql(sql),
+        'config': {field: app_config.get(field) for field in FINGERPRINT_FIELDS},
+        'sample_size': int(sample_size) if sample_size else None,
+        'export_mode': export_mode,
+        'shards': shards or None,
+        'targets': targets or None
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """查询结果缓存：缓存键 → task_id，命中时直接复用已有任务的 CSV、COCO 和图片
+
+    条目超过 ttl 秒后失效；所有条目对应任务目录的总大小超过 max_bytes 时按 LRU 淘汰。
+    淘汰只会删除缓存条目，任务目录保持不变。ttl 为 0 时不使用缓存。
+    """
+
+    def __init__(self, ttl=3600, max_bytes=10 * 1024 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key → {'task_id', 'created_at', 'nbytes'}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _pop_locked(self, key):
+        entry = self._items.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry['nbytes']
+        return entry
+
+    def get(self, key, is_valid=None):
+        """返回缓存的 task_id；is_valid(task_id) 返回 False 时（任务失败或已被删除）视为未命中"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and time.time() - entry['created_at'] > self.ttl:
+                self._pop_locked(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            task_id = entry['task_id']
+        if is_valid is not None and not is_valid(task_id):
+            self.discard(key, task_id)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return task_id
+
+    def put(self, key, task_id, nbytes=0):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pop_locked(key)
+            self._items[key] = {'task_id': task_id, 'created_at': time.time(), 'nbytes': nbytes}
+            self._bytes += nbytes
+            self._evict_locked()
+
+    def update_size(self, key, task_id, nbytes):
+        """任务完成后记录任务目录的实际大小（条目已被替换时忽略）"""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or entry['task_id'] != task_id:
+                return
+            self._bytes += nbytes - entry['nbytes']
+            entry['nbytes'] = nbytes
+            self._evict_locked()
+
+    def discard(self, key, task_id=None):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and (task_id is None or entry['task_id'] == task_id):
+                self._pop_locked(key)
+
+    def discard_task(self, task_id):
+        """删除指向 task_id 的所有条目（任务目录被清理后调用）"""
+        with self._lock:
+            for key in [key for key, entry in self._items.items() if entry['task_id'] == task_id]:
+                self._pop_locked(key)
+
+    def _evict_locked(self):
+        # 淘汰最久未使用的条目，至少保留最新的一个
+        while self._bytes > self.max_bytes and len(self._items) > 1:
+            key = next(iter(self._items))
+            self._pop_locked(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,120 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_MODES = ('reservoir', 'sql')
+
+
+class Reservoir:
+    """单个数据流的蓄水池抽样状态：逐块调用 add()，result() 返回样本
+
+    内存中只保留 sample_size 行和当前数据块，seen 为已读取的行数。
+    """
+
+    def __init__(self, sample_size, seed=42):
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.rows = None
+        self.positions = np.empty(0, dtype=np.int64)  # 样本中每行在原始结果中的位置，用于恢复顺序
+        self.seen = 0
+
+    def add(self, df):
+        n = len(df)
+        if n == 0:
+            return
+        sample_size = self.sample_size
+        df = df.reset_index(drop=True)
+        chunk_positions = np.arange(self.seen, self.seen + n, dtype=np.int64)
+
+        # 蓄水池未满时直接放入
+        filled = 0 if self.rows is None else len(self.rows)
+        fill = min(n, max(sample_size - filled, 0))
+        if fill:
+            head = df.iloc[:fill]
+            self.rows = head if self.rows is None else pd.concat([self.rows, head], ignore_index=True)
+            self.positions = np.concatenate([self.positions, chunk_positions[:fill]])
+
+        # 之后第 t 行（从 0 计数）以 k/(t+1) 的概率替换随机位置上的样本
+        if fill < n:
+            rows = np.arange(fill, n)
+            slots = self.rng.integers(0, chunk_positions[rows] + 1)
+            accepted = slots < sample_size
+            rows, slots = rows[accepted], slots[accepted]
+            if len(rows):
+                # 同一位置被多次替换时只保留最后一次
+                _, last = np.unique(slots[::-1], return_index=True)
+                keep = len(slots) - 1 - last
+                rows, slots = rows[keep], slots[keep]
+                take = np.arange(len(self.rows))
+                take[slots] = len(self.rows) + np.arange(len(rows))
+                self.rows = pd.concat([self.rows, df.iloc[rows]], ignore_index=True).iloc[take].reset_index(drop=True)
+                self.positions[slots] = chunk_positions[rows]
+        self.seen += n
+
+    def result(self):
+        """按原始结果顺序排列的样本，索引从 0 开始；没有数据时返回 None"""
+        if self.rows is None:
+            return None
+        order = np.argsort(self.positions, kind='stable')
+        return self.rows.iloc[order].reset_index(drop=True)
+
+
+def reservoir_sample(frames, sample_size, seed=42, on_rows=None):
+    """单次遍历数据块，蓄水池抽样得到 sample_size 行（种子固定，结果可复现）
+
+    内存中只保留 sample_size 行和当前数据块；返回的样本按原始结果顺序排列，索引重新从 0 开始。
+    结果总行数不超过 sample_size 时返回全部行，没有数据时返回 None。
+    on_rows(行数) 在读取每个数据块后调用，用于报告实际读取的行数。
+    """
+    reservoir = Reservoir(sample_size, seed)
+    for df in frames:
+        if on_rows is not None:
+            on_rows(len(df))
+        reservoir.add(df)
+    return reservoir.result()
+
+
+def _derived_seed(seed, key):
+    """按分组取值派生固定的种子（不使用 hash()，各进程结果一致）"""
+    return zlib.crc32(f'{seed}:{key}'.encode('utf-8'))
+
+
+def reservoir_sample_by(frames, column, sample_size, seed=42, on_rows=None):
+    """按 column 分组分别做蓄水池抽样，再合并为 sample_size 行的整体均匀样本
+
+    用于多个数据库并发查询的结果：各数据库的数据块到达顺序不固定，但每个数据库内部的顺序固定，
+    分别抽样（种子由 seed 和分组取值派生）后结果与到达顺序无关。合并时按各组行数做多元超几何抽样
+    决定每组取多少行，再从该组样本中随机选取，整体仍是均匀抽样。
+    返回的样本按分组取值排序，组内按原始顺序排列，索引从 0 开始；没有数据时返回 None。
+    """
+    reservoirs = {}
+    for df in frames:
+        if on_rows is not None:
+            on_rows(len(df))
+        if df.empty:
+            continue
+        for key, group in df.groupby(column, sort=False):
+            if key not in reservoirs:
+                reservoirs[key] = Reservoir(sample_size, _derived_seed(seed, key))
+            reservoirs[key].add(group)
+    if not reservoirs:
+        return None
+
+    keys = sorted(reservoirs)
+    seen = np.array([reservoirs[key].seen for key in keys], dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    counts = rng.multivariate_hypergeometric(seen, min(sample_size, int(seen.sum())))
+    parts = []
+    for key, count in zip(keys, counts):
+        sample = reservoirs[key].result()
+        if count < len(sample):
+            sample = sample.iloc[np.sort(rng.choice(len(sample), size=count, replace=False))]
+        parts.append(sample)
+    return pd.concat(parts, ignore_index=True)
+
+
+def sample_sql(sql, sample_size, seed=42):
+    """在数据库端抽样：子查询外按固定种子的 RAND 排序并 LIMIT，只传输 sample_size 行"""
+    inner = sql.strip().rstrip(';')
+    return f"SELECT * FROM ({inner}) AS _sampled ORDER BY RAND({int(seed)}) LIMIT {int(sample_size)}"
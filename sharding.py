@@ -0,0 +1,191 @@
+import re
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_time(value):
+    """解析 'YYYY-MM-DD HH:MM:SS' 等 ISO 格式时间，无法解析时返回 None"""
+    try:
+        return datetime.fromisoformat(str(value).strip().replace('T', ' '))
+    except ValueError:
+        return None
+
+
+def split_time_range(start_time, end_time, shards):
+    """把 [start_time, end_time] 按秒均分为最多 shards 段，返回 [(开始, 结束), ...] 字符串列表
+
+    除最后一段外每段的结束时间就是下一段的开始时间，各段为左闭右开区间（由 render_shard_sqls 保证），
+    亚秒精度的时间（DATETIME(3)/DATETIME(6)）也不会落在两段之间；最后一段以原始结束时间结尾。
+    时间无法解析或范围无效时返回 None。
+    """
+    start, end = parse_time(start_time), parse_time(end_time)
+    if start is None or end is None or end < start or shards < 1:
+        return None
+    start = start.replace(microsecond=0)
+    span = int((end - start).total_seconds())
+    shards = max(1, min(shards, span))
+    bounds = [start + timedelta(seconds=span * i // shards) for i in range(shards)]
+    ranges = []
+    for i, shard_start in enumerate(bounds):
+        shard_end = bounds[i + 1].strftime(TIME_FORMAT) if i + 1 < len(bounds) else end_time
+        ranges.append((shard_start.strftime(TIME_FORMAT), shard_end))
+    return ranges
+
+
+def _top_level_sql(sql):
+    """去掉字符串常量、注释和括号内的内容，只保留最外层的 SQL（反引号中的标识符保留）"""
+    out = []
+    depth = 0
+    i = 0
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"'):
+            # 字符串常量（支持 '' 和反斜杠转义）
+            i += 1
+            while i < n and sql[i] != ch:
+                i += 2 if sql[i] == '\\' else 1
+            i += 1
+            if depth == 0:
+                out.append("''")
+            continue
+        if sql.startswith('--', i) or ch == '#':
+            end = sql.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            continue
+        if ch == '(':
+            if depth == 0:
+                out.append('()')
+            depth += 1
+        elif ch == ')':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def unshardable_reason(sql_template):
+    """模板不能按分片包装为子查询时返回原因，否则返回 None
+
+    - 最外层有 LIMIT：每个分片各自 LIMIT，合并后最多返回 分片数 × LIMIT 行
+    - 选择列中有重名的列（如连接查询中的 a.*, b.*）：MySQL 不允许子查询结果中有重名的列
+    重名的列只能按 SQL 文本判断：多个 t.*、连接查询中的 *，以及同名的列或别名。
+    """
+    top = _top_level_sql(sql_template)
+    if re.search(r'\blimit\b', top, re.IGNORECASE):
+        return '查询包含 LIMIT'
+    match = re.search(r'\bselect\b(.*?)\bfrom\b(.*)', top, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return None
+    columns = [column.strip() for column in match.group(1).split(',')]
+    from_clause = re.split(r'\b(?:where|group|having|order|union)\b', match.group(2), flags=re.IGNORECASE)[0]
+    stars = [column for column in columns if column.endswith('*')]
+    joined = re.search(r'\bjoin\b', from_clause, re.IGNORECASE) or ',' in from_clause
+    if len(stars) > 1 or (joined and any(re.fullmatch(r'(?:distinct\s+)?\*', column, re.IGNORECASE) for column in stars)):
+        return '连接查询的选择列中可能有重名的列'
+    names = []
+    for column in columns:
+        if column.endswith('*'):
+            continue
+        name = re.search(r'`?(\w+)`?\s*$', column)
+        if name:
+            names.append(name.group(1).lower())
+    if len(names) != len(set(names)):
+        return '选择列中有重名的列'
+    return None
+
+
+def render_shard_sqls(sql_template, start_time, end_time, shards, time_field='c_time'):
+    """按时间分片渲染 SQL 模板，模板缺少时间变量或时间无法解析时返回 None（不分片）
+
+    模板中的 BETWEEN 两端都包含，除最后一个分片外在查询外层按 time_field 排除等于下一分片开始时间的行，
+    因此查询结果中必须包含 time_field 列。模板不能包装为子查询时（见 unshardable_reason）不分片。
+    """
+    if shards is None or shards <= 1:
+        return None
+    if '${START_TIME}' not in sql_template or '${END_TIME}' not in sql_template:
+        return None
+    reason = unshardable_reason(sql_template)
+    if reason:
+        print(f"⚠️ {reason}，不按时间分片，整体执行一次查询")
+        return None
+    ranges = split_time_range(start_time, end_time, shards)
+    if not ranges or len(ranges) <= 1:
+        return None
+    shard_sqls = []
+    for i, (shard_start, shard_end) in enumerate(ranges):
+        sql = sql_template.replace('${START_TIME}', shard_start).replace('${END_TIME}', shard_end)
+        if i + 1 < len(ranges):
+            sql = f"SELECT * FROM ({sql.strip().rstrip(';')}) AS _shard WHERE `{time_field}` < '{shard_end}'"
+        shard_sqls.append(sql)
+    return shard_sqls
+
+
+def _fetch_shard(client, sql, chunk_size, retries, retry_delay):
+    """读取一个分片的全部数据，失败时只重试该分片"""
+    attempt = 0
+    while True:
+        try:
+            frames = list(client.query_chunks(sql, chunk_size))
+            return pd.concat(frames, ignore_index=True) if frames else None
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            print(f"⚠️ 分片查询失败，第 {attempt} 次重试: {e}")
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+
+
+def iter_sharded_frames(client, shard_sqls, chunk_size=5000, max_workers=4, retries=2,
+                        retry_delay=0.5, sort_column='c_time', on_shard_done=None):
+    """并发执行各时间分片的查询，按分片顺序逐块返回 DataFrame
+
+    各分片在独立线程中从连接池取连接执行，最多 max_workers 个同时运行。
+    分片内按 sort_column 排序，分片之间时间不重叠，因此合并后整体按时间有序。
+    前面的分片完成后立即返回，不必等待所有分片结束；索引在所有分片间连续递增。
+    一个分片全部返回后才提交下一个分片，处理跟不上时内存中最多保留 max_workers 个分片。
+    """
+    workers = max(1, min(max_workers, len(shard_sqls)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query-shard')
+    pending = deque()
+    submitted = 0
+
+    def submit_next():
+        nonlocal submitted
+        if submitted < len(shard_sqls):
+            pending.append(executor.submit(_fetch_shard, client, shard_sqls[submitted], chunk_size,
+                                           retries, retry_delay))
+            submitted += 1
+
+    for _ in range(workers):
+        submit_next()
+    try:
+        offset = 0
+        for shard_idx in range(len(shard_sqls)):
+            df = pending.popleft().result()
+            if on_shard_done is not None:
+                on_shard_done(shard_idx, 0 if df is None else len(df))
+            if df is not None and not df.empty:
+                if sort_column in df.columns:
+                    df = df.sort_values(sort_column, kind='stable')
+                for start in range(0, len(df), chunk_size):
+                    chunk = df.iloc[start:start + chunk_size].copy()
+                    chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                    offset += len(chunk)
+                    yield chunk
+            df = None
+            submit_next()
+    finally:
+        # 出错或生成器提前关闭时取消尚未开始的分片
+        executor.shutdown(wait=False, cancel_futures=True)
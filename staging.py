@@ -0,0 +1,152 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，无法使用 reflink
+    fcntl = None
+
+# Linux ioctl FICLONE，用于 btrfs / xfs 等文件系统的 reflink（写时复制）
+FICLONE = 0x40049409
+
+# 暂存结果类型
+COPIED = 'copied'
+LINKED = 'linked'
+SKIPPED = 'skipped'
+MISSING = 'missing'
+FAILED = 'failed'
+
+
+def _is_up_to_date(src_stat, dest_path):
+    """目标文件已存在且大小、修改时间与源文件一致时无需重复暂存"""
+    try:
+        dest_stat = os.stat(dest_path)
+    except OSError:
+        return False
+    # 网络共享的时间精度不一，按 1 秒容差比较
+    return (dest_stat.st_size == src_stat.st_size
+            and abs(dest_stat.st_mtime - src_stat.st_mtime) < 1)
+
+
+def _reflink(src, dest):
+    """尝试 reflink 复制，不支持时抛出 OSError"""
+    if fcntl is None:
+        raise OSError('reflink 不可用')
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dest)
+
+
+class ImageStager:
+    """使用有界线程池把图片暂存到任务目录
+
+    link_mode:
+        'auto'    同一文件系统时优先硬链接，其次 reflink，最后复制
+        'reflink' 同一文件系统时尝试 reflink，否则复制（不共享 inode）
+        'copy'    始终复制
+
+    指定 blob_store 时，无法直接硬链接源图片的情况下先把图片放入共享仓库，
+    再把仓库文件硬链接到任务目录，多个任务中的同一张图片只占用一份磁盘空间。
+    """
+
+    def __init__(self, max_workers=8, link_mode='auto', blob_store=None):
+        self.max_workers = max_workers
+        self.link_mode = link_mode
+        self.blob_store = blob_store
+        self.bytes_copied = 0  # 实际复制的字节数（链接和跳过的不计入）
+        self._bytes_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-stage')
+
+    def _add_copied(self, nbytes):
+        with self._bytes_lock:
+            self.bytes_copied += nbytes
+
+    def stage_one(self, src, dest):
+        """暂存单张图片，返回结果类型"""
+        try:
+            src_stat = os.stat(src)
+        except FileNotFoundError:
+            return MISSING
+
+        if _is_up_to_date(src_stat, dest):
+            return SKIPPED
+
+        tmp_dest = f'{dest}.{threading.get_ident()}.tmp'
+        try:
+            same_device = os.stat(os.path.dirname(dest) or '.').st_dev == src_stat.st_dev
+            if self.link_mode == 'auto' and same_device:
+                try:
+                    os.link(src, tmp_dest)
+                    os.replace(tmp_dest, dest)
+                    return LINKED
+                except OSError:
+                    pass
+            if self.blob_store is not None:
+                # 仓库中已有该图片时只需一次 stat 和一次硬链接
+                try:
+                    created = self.blob_store.link(src, dest, src_stat, reflink=self.link_mode != 'copy')
+                    if created:
+                        self._add_copied(src_stat.st_size)
+                    return COPIED if created else LINKED
+                except OSError as e:
+                    print(f"⚠️ 图片仓库不可用，直接复制: {e}")
+            if self.link_mode != 'copy' and same_device:
+                try:
+                    _reflink(src, tmp_dest)
+                    os.replace(tmp_dest, dest)
+                    return LINKED
+                except OSError:
+                    pass
+            shutil.copy2(src, tmp_dest)
+            os.replace(tmp_dest, dest)
+            self._add_copied(src_stat.st_size)
+            return COPIED
+        finally:
+            if os.path.exists(tmp_dest):
+                try:
+                    os.remove(tmp_dest)
+                except OSError:
+                    pass
+
+    def stage(self, img_paths, dest_dir, on_result=None, missing=None, names=None):
+        """并行暂存一批图片到 dest_dir，返回各结果类型的数量
+
+        同名图片只暂存最后一次出现的路径（与逐张复制时后者覆盖前者一致）。
+        on_result(result, src) 在每张图片处理完成后调用，可用于更新进度。
+        missing 为已知不存在的路径集合（例如 PathProbe 批量检查的结果），这些路径不再逐个访问。
+        names 为与 img_paths 对应的目标文件名，默认使用源文件名。
+        不存在的图片汇总为一条警告。
+        """
+        targets = {}
+        for i, src in enumerate(img_paths):
+            if not src or not isinstance(src, str):
+                continue
+            targets[names[i] if names is not None else os.path.basename(src)] = src
+
+        stats = {COPIED: 0, LINKED: 0, SKIPPED: 0, MISSING: 0, FAILED: 0}
+        missing = missing or ()
+        missing_paths = []
+
+        def task(img_name, src):
+            if src in missing:
+                result = MISSING
+            else:
+                try:
+                    result = self.stage_one(src, os.path.join(dest_dir, img_name))
+                except Exception as e:
+                    print(f"⚠️ 复制图片警告: {src}: {e}")
+                    result = FAILED
+            if result == MISSING:
+                missing_paths.append(src)
+            if on_result is not None:
+                on_result(result, src)
+            return result
+
+        futures = [self.executor.submit(task, img_name, src) for img_name, src in targets.items()]
+        for future in futures:
+            stats[future.result()] += 1
+        if missing_paths:
+            print(f"⚠️ {len(missing_paths)} 张图片文件不存在，例如: {missing_paths[0]}")
+        return stats
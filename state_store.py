@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        return True  # Windows 上 os.kill 会结束进程，无法用来探测
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # 进程存在但没有权限发信号
+    return True
+
+
+class JobStateStore:
+    """多个 worker 进程共享的查询任务状态（SQLite，WAL 模式）
+
+    执行任务的进程写入状态、阶段、进度和耗时（不包含结果数据），其他进程据此回答进度查询。
+    pending/running 状态的任务所在进程已退出时视为失败。
+    """
+
+    def __init__(self, path, keep_seconds=3600):
+        self.path = os.path.abspath(path)
+        self.keep_seconds = keep_seconds
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                task_id TEXT PRIMARY KEY,
+                pid INTEGER,
+                status TEXT,
+                stage TEXT,
+                progress TEXT,
+                timings TEXT,
+                count INTEGER,
+                error TEXT,
+                message TEXT,
+                created_at REAL,
+                finished_at REAL
+            )
+        """)
+
+    def _conn(self):
+        # sqlite3 连接不能跨线程使用，每个线程一个连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def save(self, snapshot, created_at, finished_at=None):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (snapshot['task_id'], os.getpid(), snapshot['status'], snapshot['stage'],
+             json.dumps(snapshot['progress']), json.dumps(snapshot.get('timings') or {}),
+             snapshot['count'], snapshot['error'], snapshot['message'], created_at, finished_at)
+        )
+
+    def get(self, task_id):
+        """返回与 QueryJob.snapshot(limit=0) 结构相同的状态，不存在时返回 None"""
+        row = self._conn().execute(
+            'SELECT pid, status, stage, progress, timings, count, error, message, created_at, finished_at '
+            'FROM jobs WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        pid, status, stage, progress, timings, count, error, message, created_at, finished_at = row
+        if status in ('pending', 'running') and not _pid_alive(pid):
+            status, error = 'failed', '执行任务的进程已退出'
+            finished_at = finished_at or time.time()
+        return {
+            'task_id': task_id,
+            'status': status,
+            'stage': stage,
+            'progress': json.loads(progress),
+            'count': count,
+            'offset': 0,
+            'data': [],
+            'error': error,
+            'message': message,
+            'timings': json.loads(timings),
+            'elapsed': round((finished_at or time.time()) - created_at, 3)
+        }
+
+    def created_at(self, task_id):
+        """任务最近一次执行的创建时间，不存在时返回 None"""
+        row = self._conn().execute('SELECT created_at FROM jobs WHERE task_id = ?', (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def expire(self):
+        """删除已结束且超过保留时间的任务状态"""
+        self._conn().execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?',
+                             (time.time() - self.keep_seconds,))
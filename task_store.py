@@ -0,0 +1,146 @@
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+from coco_query import CocoFilterIndex
+
+
+class TaskIndex:
+    """单个任务的预建索引：按图片 id 查询标注、文件名、源路径和图片元数据"""
+
+    def __init__(self, task_id, coco_data, manifest, nbytes=0, version=None):
+        self.task_id = task_id
+        # 构建索引时任务文件的版本，文件被其他进程改写（增量追加）后需要重新加载
+        self.version = version
+        self.coco = coco_data
+        self.mode = manifest.get('mode', 'copy')
+        self.categories = coco_data.get('categories', [])
+        self.images_by_id = {img['id']: img for img in coco_data.get('images', [])}
+        self.annotations_by_image = defaultdict(list)
+        for ann in coco_data.get('annotations', []):
+            self.annotations_by_image[ann.get('image_id')].append(ann)
+        # 图片 id → 源图片路径 / 元数据（c_time、各状态字段），按查询结果顺序
+        self.img_paths = manifest.get('images', {})
+        self.meta = manifest.get('meta', {})
+        # 多数据库查询的图片在任务中使用加了来源前缀的文件名（图片 id → 文件名）
+        self.names = manifest.get('names', {})
+        # 按查询结果顺序排列的图片 id，用于分页
+        self.image_ids = list(self.meta) or sorted(self.images_by_id)
+        self.nbytes = nbytes
+        self._filter_index = None
+        self._filter_lock = threading.Lock()
+
+    def filename(self, image_id):
+        if image_id in self.names:
+            return self.names[image_id]
+        img_path = self.img_paths.get(image_id)
+        return os.path.basename(img_path) if img_path else None
+
+    def annotations(self, image_id):
+        return self.annotations_by_image.get(image_id, [])
+
+    def result_item(self, image_id):
+        """查询接口返回的单条结果（基本信息 + 标注）"""
+        img_path = self.img_paths.get(image_id, '')
+        meta = self.meta.get(image_id, {})
+        return {
+            'id': image_id,
+            'img_name': self.filename(image_id) or '',
+            'img_path': img_path,
+            'c_time': meta.get('c_time', ''),
+            'check_status': meta.get('check_status', ''),
+            'detection_result_status': meta.get('detection_result_status', ''),
+            'manual_check_status': meta.get('manual_check_status', ''),
+            'annotations': [{
+                'bbox': ann.get('bbox', []),
+                'category': ann.get('category', ''),
+                'category_id': ann.get('category_id', 0),
+                'score': ann.get('score', 0)
+            } for ann in self.annotations(image_id)]
+        }
+
+    def page(self, offset, limit):
+        """按结果顺序返回 offset 开始的 limit 条结果"""
+        return [self.result_item(image_id) for image_id in self.image_ids[offset:offset + limit]]
+
+    def filter_index(self):
+        """类别、置信度和状态的筛选索引，第一次筛选时构建"""
+        with self._filter_lock:
+            if self._filter_index is None:
+                self._filter_index = CocoFilterIndex(self)
+            return self._filter_index
+
+    def filtered_records(self, image_ids):
+        """指定图片及其标注，返回 (images, categories, annotations)，images 和 annotations 为生成器
+
+        用于逐条写出筛选后的 COCO 数据，耗时与所选图片数成正比。
+        """
+        image_ids = [image_id for image_id in sorted(image_ids) if image_id in self.images_by_id]
+        images = (self.images_by_id[image_id] for image_id in image_ids)
+        annotations = (ann for image_id in image_ids for ann in self.annotations(image_id))
+        return images, self.categories, annotations
+
+
+class TaskStore:
+    """按估算内存大小做 LRU 淘汰的任务索引缓存
+
+    loader(task_id) 在缓存未命中时从磁盘构建 TaskIndex，任务不存在时返回 None。
+    version(task_id) 返回任务文件的当前版本，与缓存索引的版本不一致时重新加载。
+    """
+
+    def __init__(self, loader, max_bytes=512 * 1024 * 1024, version=None):
+        self.loader = loader
+        self.version = version
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, task_id):
+        version = self.version(task_id) if self.version else None
+        with self._lock:
+            index = self._items.get(task_id)
+            if index is not None and self.version and index.version != version:
+                # 任务文件已被改写，丢弃旧索引
+                del self._items[task_id]
+                self._bytes -= index.nbytes
+                index = None
+            if index is not None:
+                self._items.move_to_end(task_id)
+                self.hits += 1
+                return index
+            self.misses += 1
+        index = self.loader(task_id)
+        if index is not None:
+            self.put(index)
+        return index
+
+    def put(self, index):
+        with self._lock:
+            old = self._items.pop(index.task_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._items[index.task_id] = index
+            self._bytes += index.nbytes
+            # 淘汰最久未使用的任务，至少保留刚放入的一个
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def invalidate(self, task_id):
+        with self._lock:
+            old = self._items.pop(task_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tasks': len(self._items),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
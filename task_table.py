@@ -0,0 +1,124 @@
+import os
+import glob
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # 未安装 pyarrow 时退回 CSV
+    pa = None
+
+CSV_FILE = 'result.csv'
+PART_PATTERN = 'result-{:05d}.arrow'
+STORAGE_FORMATS = ('auto', 'arrow', 'csv')
+
+
+def resolve_format(storage_format):
+    """'auto' 在安装了 pyarrow 时使用 Arrow IPC，否则使用 CSV"""
+    if storage_format == 'csv' or pa is None:
+        return 'csv'
+    return 'arrow'
+
+
+def arrow_parts(task_dir):
+    return sorted(glob.glob(os.path.join(task_dir, 'result-*.arrow')))
+
+
+def has_table(task_dir):
+    return bool(arrow_parts(task_dir)) or os.path.exists(os.path.join(task_dir, CSV_FILE))
+
+
+def _to_arrow(df):
+    """DataFrame 转为 Arrow 表；混合类型的 object 列转为字符串后再转换"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for column in df.columns:
+            if df[column].dtype == object:
+                df[column] = df[column].map(lambda value: value if value is None or isinstance(value, str) else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class TaskTableWriter:
+    """逐块保存任务的查询结果
+
+    Arrow 格式下每个数据块写一个 IPC 文件（result-00000.arrow ...），保留列类型，
+    读取时可以内存映射并只读取需要的列；CSV 格式与旧版一样追加写入 result.csv。
+    append 为 True 时在已有结果之后继续写入（沿用已有结果的格式），出错时 rollback() 撤销本次写入。
+    """
+
+    def __init__(self, task_dir, storage_format='auto', append=False):
+        self.task_dir = task_dir
+        self.format = resolve_format(storage_format)
+        self.parts = 0
+        if append and has_table(task_dir):
+            parts = arrow_parts(task_dir)
+            self.format = 'arrow' if parts and pa is not None else 'csv'
+            self.parts = int(os.path.basename(parts[-1])[7:12]) + 1 if self.format == 'arrow' else 1
+        self._first_part = self.parts
+        csv_path = os.path.join(task_dir, CSV_FILE)
+        self._csv_size = os.path.getsize(csv_path) if self.parts and os.path.exists(csv_path) else 0
+
+    def write(self, df):
+        if self.format == 'arrow':
+            table = _to_arrow(df)
+            path = os.path.join(self.task_dir, PART_PATTERN.format(self.parts))
+            with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            # 第一块写表头，后续追加
+            df.to_csv(os.path.join(self.task_dir, CSV_FILE), mode='w' if self.parts == 0 else 'a',
+                      header=self.parts == 0, index=False, encoding='utf-8')
+        self.parts += 1
+
+    def rollback(self):
+        """删除本次写入的数据块（CSV 截断到写入前的长度）"""
+        if self.format == 'arrow':
+            for part in range(self._first_part, self.parts):
+                path = os.path.join(self.task_dir, PART_PATTERN.format(part))
+                if os.path.exists(path):
+                    os.remove(path)
+        elif self.parts > self._first_part:
+            csv_path = os.path.join(self.task_dir, CSV_FILE)
+            if self._csv_size:
+                os.truncate(csv_path, self._csv_size)
+            elif os.path.exists(csv_path):
+                os.remove(csv_path)
+        self.parts = self._first_part
+
+
+def _read_part(path, columns=None):
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select([column for column in columns if column in table.column_names])
+    return table
+
+
+def read_task_table(task_dir, columns=None):
+    """读取任务的查询结果，columns 指定只读取的列；没有结果文件时返回 None"""
+    parts = arrow_parts(task_dir)
+    if parts and pa is not None:
+        tables = [_read_part(path, columns) for path in parts]
+        return pa.concat_tables(tables, promote_options='default').to_pandas()
+    csv_path = os.path.join(task_dir, CSV_FILE)
+    if os.path.exists(csv_path):
+        usecols = None if columns is None else (lambda column: column in columns)
+        return pd.read_csv(csv_path, encoding='utf-8', usecols=usecols)
+    return None
+
+
+def iter_task_csv(task_dir, encoding='utf-8'):
+    """逐块把任务结果转换为 CSV 文本，用于流式下载（Arrow 格式按需生成，不落盘）"""
+    parts = arrow_parts(task_dir)
+    if parts and pa is not None:
+        for i, path in enumerate(parts):
+            yield _read_part(path).to_pandas().to_csv(index=False, header=i == 0).encode(encoding)
+        return
+    with open(os.path.join(task_dir, CSV_FILE), 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            yield data
@@ -0,0 +1,128 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时不生成缩略图，由调用方回退到原图
+    Image = None
+
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+}
+
+
+class ThumbnailCache:
+    """缩略图服务：在线程池中生成限定尺寸的预览图，并缓存到磁盘
+
+    缓存键由源图片路径、修改时间、文件大小、尺寸和格式组成，源图片变化后自动失效。
+    缓存总大小超过 max_bytes 时按最近访问时间（LRU）删除旧文件。
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, max_workers=4, quality=80):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='thumbnail')
+        self._lock = threading.Lock()
+        self._pending = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._scan())
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _scan(self):
+        """返回缓存中所有文件的 (路径, 大小, 最近访问时间)"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _cache_path(self, src_path, src_stat, size, fmt):
+        raw = f'{os.path.abspath(src_path)}|{src_stat.st_mtime_ns}|{src_stat.st_size}|{size}|{fmt}'
+        key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + FORMATS[fmt][1])
+
+    def _render(self, src_path, dest_path, size, fmt):
+        pil_format = FORMATS[fmt][0]
+        with Image.open(src_path) as img:
+            # JPEG 可以在解码时直接缩小，大幅减少解码开销
+            img.draft('RGB', (size, size))
+            img.thumbnail((size, size))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            tmp_path = f'{dest_path}.{threading.get_ident()}.tmp'
+            try:
+                img.save(tmp_path, pil_format, quality=self.quality)
+                os.replace(tmp_path, dest_path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return os.path.getsize(dest_path)
+
+    def get(self, src_path, size=320, fmt='jpeg'):
+        """返回 (缩略图路径, mimetype)，源文件不存在时抛出 FileNotFoundError"""
+        src_stat = os.stat(src_path)
+        dest_path = self._cache_path(src_path, src_stat, size, fmt)
+        if os.path.exists(dest_path):
+            # 更新修改时间作为最近访问时间，供 LRU 淘汰使用
+            try:
+                os.utime(dest_path)
+            except OSError:
+                pass
+            return dest_path, FORMATS[fmt][2]
+
+        # 同一张缩略图只生成一次，其他请求等待同一个任务
+        with self._lock:
+            future = self._pending.get(dest_path)
+            if future is None:
+                future = self.executor.submit(self._render, src_path, dest_path, size, fmt)
+                self._pending[dest_path] = future
+                owner = True
+            else:
+                owner = False
+        try:
+            nbytes = future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    self._pending.pop(dest_path, None)
+        if owner:
+            with self._lock:
+                self._bytes += nbytes
+                over_budget = self._bytes > self.max_bytes
+            if over_budget:
+                self.evict()
+        return dest_path, FORMATS[fmt][2]
+
+    def evict(self):
+        """按最近访问时间删除旧缩略图，直到总大小降到上限的 90% 以下"""
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {'bytes': self._bytes, 'max_bytes': self.max_bytes, 'available': self.available}
@@ -0,0 +1,11 @@
+"""
+多进程部署入口，例如:
+    gunicorn -w 4 -b 0.0.0.0:5050 --timeout 300 wsgi:app
+
+每个 worker 进程导入本模块时各自创建连接池和后台线程；配置文件、任务目录（exports/）
+和任务状态（exports/_state.sqlite）在进程之间共享，因此所有 worker 需要运行在同一台机器上
+（或通过 EXPORT_DIR、CONFIG_FILE 环境变量指向共享目录）。
+"""
+from app import create_app
+
+app = create_app()
@@ -0,0 +1,81 @@
+import io
+import time
+import zipfile
+
+# 已经压缩过的图片格式直接存储，再次压缩只会浪费 CPU
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+class _StreamBuffer(io.RawIOBase):
+    """只写缓冲区，不支持 seek，zipfile 会自动改用数据描述符写法"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        """取出并清空已写入的数据"""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _compress_type(arcname):
+    if arcname.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_zip(entries, read_size=1024 * 1024):
+    """边读取边生成 ZIP 数据，整个压缩包不会落盘也不会完整驻留内存
+
+    entries 为 (arcname, source) 的可迭代对象，source 可以是：
+        - 文件路径（str）
+        - bytes
+        - 逐块产生 bytes 的可迭代对象（长度未知，强制使用 ZIP64）
+    JPEG/PNG 等已压缩格式使用 ZIP_STORED，其余使用 ZIP_DEFLATED；超过 4GB 的条目自动使用 ZIP64。
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zf:
+        for arcname, source in entries:
+            if isinstance(source, str):
+                info = zipfile.ZipInfo.from_file(source, arcname)
+                info.compress_type = _compress_type(arcname)
+                with open(source, 'rb') as src, zf.open(info, 'w') as dest:
+                    while True:
+                        data = src.read(read_size)
+                        if not data:
+                            break
+                        dest.write(data)
+                        chunk = buffer.drain()
+                        if chunk:
+                            yield chunk
+            else:
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                info.compress_type = _compress_type(arcname)
+                info.external_attr = 0o644 << 16
+                if isinstance(source, (bytes, bytearray)):
+                    info.file_size = len(source)
+                    source = [source]
+                    force_zip64 = False
+                else:
+                    force_zip64 = True
+                with zf.open(info, 'w', force_zip64=force_zip64) as dest:
+                    for data in source:
+                        dest.write(data)
+                        chunk = buffer.drain()
+                        if chunk:
+                            yield chunk
+            chunk = buffer.drain()
+            if chunk:
+                yield chunk
+    # 中央目录
+    chunk = buffer.drain()
+    if chunk:
+        yield chunk